@@ -1,36 +1,49 @@
+import argparse
+import asyncio
 import os
 import json
 import time
 import pandas as pd
-import sys
 from dotenv import load_dotenv
 from google import genai
-from google.genai.errors import ServerError
+from google.genai import types
+from google.genai.errors import APIError
+
+from batching import split_by_tokens, token_budget_for
+from checkpoint import BatchManifest, file_hash
+from dispatch import AdaptiveRateLimiter, is_retryable, map_in_order
+from labelcache import LabelCache, scheme_version
+from labels import ITEMS, LabelMatrix
+from loaders import load_csv
+from prefilter import PreClassifier, pre_classifier_from_env
 
 # 載入 .env 中的 GEMINI_API_KEY
 load_dotenv()
 
-# 定義評分項目（依據原始 xlsx 編碼規則）
-ITEMS = [
-    "引導",
-    "評估(口語、跟讀的內容有關)",
-    "評估(非口語、寶寶自發性動作、跟讀的內容有關)",
-    "延伸討論",
-    "複述",
-    "開放式問題",
-    "填空",
-    "回想",
-    "人事時地物問句",
-    "連結生活經驗",
-    "備註"
-]
+MODEL_NAME = "gemini-2.0-flash"
 
-def parse_response(response_text):
-    """
-    嘗試解析 Gemini API 回傳的 JSON 格式結果。
-    如果回傳內容被 markdown 的反引號包圍，則先移除這些標記。
-    若解析失敗，則回傳所有項目皆為空的字典。
-    """
+
+# 結構化輸出：回傳 JSON 陣列，每筆逐字稿一個物件，以 id 對應送出的逐字稿
+RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            **{item: {"type": "STRING", "enum": ["1", "0"]} for item in ITEMS},
+        },
+        "required": ["id", *ITEMS],
+    },
+}
+STRUCTURED_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=RESPONSE_SCHEMA,
+)
+
+# 模型回覆中代表「觸及」與「未觸及」的值，寫入輸出檔時分別為 "1" 與空白
+LABEL_VALUES = {"1": "1", 1: "1", "0": "", 0: "", "": ""}
+
+def strip_code_fence(response_text: str) -> str:
     cleaned = response_text.strip()
     # 如果回傳內容以三個反引號開始，則移除第一行和最後一行
     if cleaned.startswith("```"):
@@ -40,9 +53,16 @@ def parse_response(response_text):
         if lines and lines[-1].strip() == "```":
             lines = lines[:-1]
         cleaned = "\n".join(lines).strip()
-    
+    return cleaned
+
+def parse_response(response_text):
+    """
+    嘗試解析 Gemini API 回傳的 JSON 格式結果。
+    如果回傳內容被 markdown 的反引號包圍，則先移除這些標記。
+    若解析失敗，則回傳所有項目皆為空的字典。
+    """
     try:
-        result = json.loads(cleaned)
+        result = json.loads(strip_code_fence(response_text))
         for item in ITEMS:
             if item not in result:
                 result[item] = ""
@@ -65,7 +85,7 @@ def select_dialogue_column(chunk: pd.DataFrame) -> str:
     print("CSV 欄位：", list(chunk.columns))
     return chunk.columns[0]
 
-def process_batch_dialogue(client, dialogues: list, delimiter="-----"):
+def build_batch_prompt(dialogues: list, delimiter="-----") -> str:
     """
     將多筆逐字稿合併成一個批次請求。
     提示中要求模型對每筆逐字稿產生 JSON 格式回覆，
@@ -84,42 +104,290 @@ def process_batch_dialogue(client, dialogues: list, delimiter="-----"):
         "{{...}}\n```"
     )
     batch_text = f"\n{delimiter}\n".join(dialogues)
-    content = prompt + "\n\n" + batch_text
+    return prompt + "\n\n" + batch_text
 
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=content
-        )
-    except ServerError as e:
-        print(f"API 呼叫失敗：{e}")
-        return [{item: "" for item in ITEMS} for _ in dialogues]
-    
-    print("批次 API 回傳內容：", response.text)
-    parts = response.text.split(delimiter)
+def split_batch_response(response_text: str, count: int, delimiter="-----") -> list:
+    """
+    依 delimiter 切開批次回覆並逐筆解析，結果筆數對齊 count。
+    """
+    print("批次 API 回傳內容：", response_text)
+    parts = response_text.split(delimiter)
     results = []
     for part in parts:
         part = part.strip()
         if part:
             results.append(parse_response(part))
     # 若結果數量多於原始筆數，僅取前面對應筆數；若不足則補足空結果
-    if len(results) > len(dialogues):
-        results = results[:len(dialogues)]
-    elif len(results) < len(dialogues):
-        results.extend([{item: "" for item in ITEMS}] * (len(dialogues) - len(results)))
+    if len(results) > count:
+        results = results[:count]
+    elif len(results) < count:
+        results.extend([{item: "" for item in ITEMS}] * (count - len(results)))
     return results
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python DRai.py <path_to_csv>")
-        sys.exit(1)
-    
-    input_csv = sys.argv[1]
+def build_structured_prompt(dialogues: dict) -> str:
+    """
+    結構化輸出的提示：每筆逐字稿前標上 id，要求模型依 RESPONSE_SCHEMA 逐筆回覆。
+    """
+    prompt = (
+        "你是一位親子對話分析專家，請根據以下編碼規則評估家長唸故事書時的每一句話，\n"
+        + "\n".join(ITEMS) +
+        "\n\n請依據評估結果，對每個項目：若觸及則標記為 \"1\"，否則標記為 \"0\"。"
+        " 請回傳 JSON 陣列，每筆逐字稿一個物件，並以 id 欄位填入該筆逐字稿前方的編號。"
+    )
+    batch_text = "\n".join(f"[{utterance_id}] {text}" for utterance_id, text in dialogues.items())
+    return prompt + "\n\n" + batch_text
+
+def parse_structured_response(response_text: str, ids: list) -> dict:
+    """
+    解析結構化回覆，回傳 {id: 結果}，只保留 ids 中且格式正確的項目；
+    id 重複、缺少項目或值不在 LABEL_VALUES 中的都視為無效，交由呼叫端重新送出。
+    """
+    try:
+        rows = json.loads(strip_code_fence(response_text))
+    except ValueError as e:
+        print(f"解析 JSON 失敗：{e}")
+        print("原始回傳內容：", response_text)
+        return {}
+    if not isinstance(rows, list):
+        print("回傳內容不是 JSON 陣列：", response_text)
+        return {}
+    expected = set(ids)
+    results = {}
+    duplicated = set()
+    for row in rows:
+        if not isinstance(row, dict) or row.get("id") not in expected:
+            continue
+        utterance_id = row["id"]
+        if utterance_id in results:
+            duplicated.add(utterance_id)
+            continue
+        labels = [row.get(item) for item in ITEMS]
+        if all(isinstance(value, (str, int)) and value in LABEL_VALUES for value in labels):
+            results[utterance_id] = {item: LABEL_VALUES[value] for item, value in zip(ITEMS, labels)}
+    for utterance_id in duplicated:
+        results.pop(utterance_id, None)
+    return results
+
+def collect_structured_results(results: dict, count: int) -> list:
+    """
+    依 id 1..count 排出結果，重試後仍缺少結果的逐字稿為 None。
+    有效的結果仍會存入快取，批次列入重試清單後，下次只需重送缺少結果的逐字稿。
+    """
+    missing = [utterance_id for utterance_id in range(1, count + 1) if utterance_id not in results]
+    if missing:
+        print(f"以下逐字稿重試後仍無有效結果：{missing}")
+    return [results.get(utterance_id) for utterance_id in range(1, count + 1)]
+
+def process_batch_structured(client, dialogues: list, retries: int = 3) -> list:
+    """
+    以結構化輸出送出一個批次；只將缺漏或格式不符的 id 重新送出，最多 retries 次。
+    """
+    results = {}
+    pending = list(range(1, len(dialogues) + 1))
+    for attempt in range(1, retries + 1):
+        content = build_structured_prompt({i: dialogues[i - 1] for i in pending})
+        try:
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=content,
+                config=STRUCTURED_CONFIG
+            )
+        except APIError as e:
+            if not is_retryable(e):
+                raise
+            print(f"API 呼叫失敗（第 {attempt}/{retries} 次）：{e}")
+            time.sleep(2 ** attempt)
+            continue
+        results.update(parse_structured_response(response.text, pending))
+        pending = [i for i in pending if i not in results]
+        if not pending:
+            break
+        print(f"{len(pending)} 筆結果缺漏或格式不符，重新送出：{pending}")
+    return collect_structured_results(results, len(dialogues))
+
+async def process_batch_structured_async(client, dialogues: list, limiter: AdaptiveRateLimiter,
+                                         retries: int = 3) -> list:
+    """
+    process_batch_structured 的 async 版本，請求經由 limiter 排程。
+    """
+    results = {}
+    pending = list(range(1, len(dialogues) + 1))
+    for attempt in range(1, retries + 1):
+        content = build_structured_prompt({i: dialogues[i - 1] for i in pending})
+        try:
+            async with limiter:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=content,
+                    config=STRUCTURED_CONFIG
+                )
+        except APIError as e:
+            if not is_retryable(e):
+                raise
+            print(f"API 呼叫失敗（第 {attempt}/{retries} 次）：{e}")
+            continue
+        results.update(parse_structured_response(response.text, pending))
+        pending = [i for i in pending if i not in results]
+        if not pending:
+            break
+        print(f"{len(pending)} 筆結果缺漏或格式不符，重新送出：{pending}")
+    return collect_structured_results(results, len(dialogues))
+
+def process_batch_dialogue(client, dialogues: list, delimiter="-----"):
+    """
+    以同步 API 送出一個批次並解析結果；API 呼叫失敗時回傳 None。
+    """
+    content = build_batch_prompt(dialogues, delimiter)
+    try:
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=content
+        )
+    except APIError as e:
+        if not is_retryable(e):
+            raise
+        print(f"API 呼叫失敗：{e}")
+        return None
+    return split_batch_response(response.text, len(dialogues), delimiter)
+
+async def process_batch_dialogue_async(client, dialogues: list, limiter: AdaptiveRateLimiter,
+                                       retries: int = 3, delimiter="-----"):
+    """
+    以 async API 送出一個批次；遇到 429 或 5xx 錯誤時由 limiter 退避後重試，
+    重試 retries 次仍失敗則與同步版本相同，回傳 None。
+    """
+    content = build_batch_prompt(dialogues, delimiter)
+    for attempt in range(1, retries + 1):
+        try:
+            async with limiter:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=content
+                )
+            return split_batch_response(response.text, len(dialogues), delimiter)
+        except APIError as e:
+            if not is_retryable(e):
+                raise
+            print(f"API 呼叫失敗（第 {attempt}/{retries} 次）：{e}")
+    return None
+
+def numbered_batches(batches):
+    """
+    為每個批次附上在輸入檔中的起訖列號 (start, end)。
+    """
+    end = 0
+    for batch in batches:
+        start = end
+        end = start + len(batch)
+        yield start, end, batch
+
+def save_batch(start: int, end: int, batch: pd.DataFrame, batch_results: list, output_csv: str,
+               manifest: BatchManifest):
+    """
+    將批次結果加到原始欄位後附加到輸出檔，輸出檔為空時先寫入標題列，並更新 manifest。
+    batch_results 為 None 表示批次失敗，只列入重試清單，不寫入空白標記。
+    """
+    if batch_results is None:
+        manifest.mark_failed(start, end)
+        print(f"第 {start + 1} 到 {end} 筆處理失敗，已列入重試清單")
+        return
+    labels = LabelMatrix.from_results(batch_results).to_strings().set_axis(batch.index)
+    # 輸入檔已有同名的項目欄位（例如重新編碼 113_batch.csv）時以新結果取代，避免標題重複
+    batch_df = pd.concat([batch.drop(columns=ITEMS, errors="ignore"), labels], axis=1)
+    header = not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+    batch_df.to_csv(output_csv, mode='a', index=False, header=header, encoding="utf-8-sig")
+    manifest.mark_written(start, end, os.path.getsize(output_csv))
+
+def restore_row_order(output_csv: str, manifest: BatchManifest):
+    """
+    所有批次都寫入後，若重試的批次排在較後面，依 manifest 記錄的批次寫入順序重寫輸出檔並更新 manifest。
+    """
+    order = manifest.input_order()
+    if order == sorted(order):
+        return
+    df = pd.read_csv(output_csv, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    tmp_path = f"{output_csv}.tmp"
+    df.iloc[order].to_csv(tmp_path, index=False, encoding="utf-8-sig")
+    os.replace(tmp_path, output_csv)
+    manifest.mark_rewritten(os.path.getsize(output_csv))
+    print("重試的批次已依輸入順序排回輸出檔")
+
+def prepare_batch(dialogues: list, prefilter: PreClassifier, cache: LabelCache):
+    """
+    先以本地預分類標記高信心的句子，其餘查詢快取；回傳 (plan, misses)，misses 為需送出的句子。
+    """
+    local = prefilter.classify(dialogues)
+    undecided = [text for text, result in zip(dialogues, local) if result is None]
+    cached, misses = cache.lookup(undecided)
+    return (local, undecided, cached), misses
+
+def finish_batch(plan, misses: list, miss_results: list | None, cache: LabelCache) -> list | None:
+    """
+    依原順序合併本地結果、快取結果與 API 結果；miss_results 為 None 或其中有 None 表示批次失敗。
+    """
+    local, undecided, cached = plan
+    undecided_results = cache.merge(undecided, cached, misses, miss_results)
+    if undecided_results is None:
+        return None
+    remaining = iter(undecided_results)
+    return [result if result is not None else next(remaining) for result in local]
+
+def run_sequential(client, batches, dialogue_col: str, output_csv: str, total: int, structured: bool,
+                   manifest: BatchManifest, cache: LabelCache, prefilter: PreClassifier):
+    retries = int(os.environ.get("BATCH_RETRIES", "3"))
+    for start, end, batch in batches:
+        dialogues = [str(d).strip() for d in batch[dialogue_col].tolist()]
+        # 只送出本地無法判斷且快取中沒有的句子
+        plan, misses = prepare_batch(dialogues, prefilter, cache)
+        if not misses:
+            miss_results = []
+        elif structured:
+            miss_results = process_batch_structured(client, misses, retries)
+        else:
+            miss_results = process_batch_dialogue(client, misses)
+        batch_results = finish_batch(plan, misses, miss_results, cache)
+        save_batch(start, end, batch, batch_results, output_csv, manifest)
+        print(f"已處理 {manifest.next_row} 筆 / {total}")
+        if misses:
+            time.sleep(1)
+
+async def run_concurrent(client, batches, dialogue_col: str, output_csv: str, total: int, concurrency: int,
+                         structured: bool, manifest: BatchManifest, cache: LabelCache, prefilter: PreClassifier):
+    """
+    最多 concurrency 個批次同時送出，結果依輸入順序寫入，輸出檔與逐批處理時相同。
+    """
+    limiter = AdaptiveRateLimiter(
+        max_concurrency=concurrency,
+        min_interval=float(os.environ.get("BATCH_MIN_INTERVAL", "0.25")),
+    )
+    retries = int(os.environ.get("BATCH_RETRIES", "3"))
+
+    async def classify(numbered):
+        start, end, batch = numbered
+        dialogues = [str(d).strip() for d in batch[dialogue_col].tolist()]
+        plan, misses = prepare_batch(dialogues, prefilter, cache)
+        if not misses:
+            miss_results = []
+        elif structured:
+            miss_results = await process_batch_structured_async(client, misses, limiter, retries)
+        else:
+            miss_results = await process_batch_dialogue_async(client, misses, limiter, retries)
+        return numbered, finish_batch(plan, misses, miss_results, cache)
+
+    # 視窗設為並行數的兩倍，最前面的批次較慢時後面的請求仍能持續送出
+    async for (start, end, batch), batch_results in map_in_order(classify, batches, window=concurrency * 2):
+        save_batch(start, end, batch, batch_results, output_csv, manifest)
+        print(f"已處理 {manifest.next_row} 筆 / {total}")
+
+def main(input_csv: str, resume: bool = False):
     output_csv = "113_batch.csv"
-    if os.path.exists(output_csv):
-        os.remove(output_csv)
+    manifest_path = os.path.splitext(output_csv)[0] + ".manifest.json"
+    if not resume:
+        for path in (output_csv, manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
     
-    df = pd.read_csv(input_csv)
+    df = load_csv(input_csv)
     gemini_api_key = os.environ.get("GEMINI_API_KEY")
     if not gemini_api_key:
         raise ValueError("請設定環境變數 GEMINI_API_KEY")
@@ -128,25 +396,79 @@ def main():
     dialogue_col = select_dialogue_column(df)
     print(f"使用欄位作為逐字稿：{dialogue_col}")
     
-    batch_size = 10
+    # 依 token 預算打包批次，BATCH_MAX_ROWS 限制每批筆數以免模型輸出過長
+    token_budget = token_budget_for(MODEL_NAME)
+    max_rows = int(os.environ.get("BATCH_MAX_ROWS", "40"))
     total = len(df)
-    for start_idx in range(0, total, batch_size):
-        end_idx = min(start_idx + batch_size, total)
-        batch = df.iloc[start_idx:end_idx]
-        dialogues = batch[dialogue_col].tolist()
-        dialogues = [str(d).strip() for d in dialogues]
-        batch_results = process_batch_dialogue(client, dialogues)
-        batch_df = batch.copy()
-        for item in ITEMS:
-            batch_df[item] = [res.get(item, "") for res in batch_results]
-        if start_idx == 0:
-            batch_df.to_csv(output_csv, index=False, encoding="utf-8-sig")
+    # 輸入檔、筆數與分批設定相同時批次邊界才會一致，才能接續上次的進度
+    manifest = BatchManifest.open(
+        manifest_path,
+        key={
+            "input": file_hash(input_csv),
+            "rows": total,
+            "dialogue_col": dialogue_col,
+            "model": MODEL_NAME,
+            "token_budget": token_budget,
+            "max_rows": max_rows,
+        },
+        resume=resume,
+    )
+    # 捨棄最後一個完整寫入批次之後的內容（例如寫到一半中斷的批次）
+    with open(output_csv, "ab") as handle:
+        handle.truncate(manifest.output_offset)
+    if manifest.next_row:
+        print(f"接續執行：已處理 {manifest.next_row} 筆，重試清單 {len(manifest.failed)} 批")
+    batches = [
+        (start, end, batch)
+        for start, end, batch in numbered_batches(split_by_tokens(df, token_budget, max_rows, columns=[dialogue_col]))
+        if manifest.is_pending(start, end)
+    ]
+    # BATCH_OUTPUT=delimiter 改回以分隔線切開回覆的舊格式，預設使用結構化輸出
+    structured = os.environ.get("BATCH_OUTPUT", "schema") != "delimiter"
+    # LABEL_CACHE 為逐句編碼結果的 SQLite 快取檔，設為空字串則停用；
+    # 分隔線格式的回覆可能錯位，不寫入快取
+    cache_path = os.environ.get("LABEL_CACHE", "label_cache.sqlite") if structured else None
+    cache = LabelCache(cache_path or None, MODEL_NAME, scheme_version(ITEMS))
+    prefilter = pre_classifier_from_env(ITEMS)
+    # BATCH_CONCURRENCY 為同時送出的批次數，設為 1 則逐批處理
+    concurrency = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+    try:
+        if concurrency > 1:
+            asyncio.run(run_concurrent(client, batches, dialogue_col, output_csv, total, concurrency, structured,
+                                       manifest, cache, prefilter))
         else:
-            batch_df.to_csv(output_csv, mode='a', index=False, header=False, encoding="utf-8-sig")
-        print(f"已處理 {end_idx} 筆 / {total}")
-        time.sleep(1)
+            run_sequential(client, batches, dialogue_col, output_csv, total, structured, manifest, cache, prefilter)
+    finally:
+        cache.close()
+    if prefilter.total:
+        skipped = prefilter.local_hits + cache.hits
+        print(f"本地預分類 {prefilter.local_hits} 句（規則 {prefilter.rule_hits}、模型 {prefilter.model_hits}），"
+              f"快取命中 {cache.hits} 句；{skipped} / {prefilter.total} 句"
+              f"（{skipped / prefilter.total:.1%}）未送至 Gemini")
     
+    if manifest.failed:
+        ranges = ", ".join(f"{start + 1}-{end}" for start, end in manifest.failed)
+        print(f"以下批次處理失敗，未寫入輸出檔：{ranges}")
+        print("請以 --resume 重新執行以重試這些批次。")
+    elif os.path.getsize(output_csv):
+        restore_row_order(output_csv, manifest)
+    # 另存位元壓縮的標記矩陣，供 labels.py 與 getPDF 直接統計；所有批次都失敗時輸出檔為空，略過
+    if os.path.getsize(output_csv):
+        labels_path = os.path.splitext(output_csv)[0] + ".labels.npz"
+        labels_df = pd.read_csv(output_csv, usecols=ITEMS, dtype="string")
+        # 仍有失敗批次時輸出檔可能未依輸入順序，矩陣一律依輸入順序排列
+        labels_df = labels_df.iloc[manifest.input_order()]
+        LabelMatrix.from_frame(labels_df, session=os.path.basename(input_csv)).save(labels_path)
+        print("標記矩陣已寫入：", labels_path)
     print("全部處理完成。最終結果已寫入：", output_csv)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="以 Gemini 對逐字稿逐句編碼")
+    parser.add_argument("input_csv", help="逐字稿 CSV 檔案路徑")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="依 manifest 接續上次中斷的執行，並重試失敗的批次",
+    )
+    args = parser.parse_args()
+    main(args.input_csv, resume=args.resume)
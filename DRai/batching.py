@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# 英數字元平均約 4 個字元一個 token，中文字元大多一字一個 token
+ASCII_CHARS_PER_TOKEN = 4
+
+# 每個批次的目標提示 token 數，依模型名稱前綴比對（例如 gemini-2.5-pro-exp-03-25）
+MODEL_TOKEN_BUDGETS = {
+    "gemini-2.0-flash": 1500,
+    "gemini-2.5-pro": 3000,
+}
+DEFAULT_TOKEN_BUDGET = 1500
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    以字元數快速估算 token 數，不需載入分詞器。
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return -(-ascii_chars // ASCII_CHARS_PER_TOKEN) + other_chars
+
+
+def estimate_row_tokens(df: pd.DataFrame) -> pd.Series:
+    """
+    以向量化方式估算每一列轉成 CSV 文字後的 token 數。
+    """
+    total = pd.Series(0, index=df.index, dtype="int64")
+    for col in df.columns:
+        values = df[col].astype("string").fillna("")
+        chars = values.str.len().astype("int64")
+        other_chars = values.str.count(r"[^\x00-\x7f]").astype("int64")
+        total += -(-(chars - other_chars) // ASCII_CHARS_PER_TOKEN) + other_chars + 1
+    return total
+
+
+def token_budget_for(model_name: str) -> int:
+    """
+    取得模型的批次 token 預算；可用環境變數 BATCH_TOKEN_BUDGET 覆寫。
+    """
+    override = os.environ.get("BATCH_TOKEN_BUDGET")
+    if override:
+        return int(override)
+    matches = [prefix for prefix in MODEL_TOKEN_BUDGETS if model_name.startswith(prefix)]
+    if not matches:
+        return DEFAULT_TOKEN_BUDGET
+    return MODEL_TOKEN_BUDGETS[max(matches, key=len)]
+
+
+def split_by_tokens(df: pd.DataFrame, token_budget: int, max_rows: int = None, columns: list = None):
+    """
+    依 token 預算將 DataFrame 切成連續的區塊。
+    只計算 columns 指定的欄位（預設為全部欄位）；每個區塊至少一列，
+    max_rows 另外限制每個區塊的最大筆數，避免模型輸出過長。
+    """
+    if df.empty:
+        return
+    measured = df[columns] if columns else df
+    cumulative = np.cumsum(estimate_row_tokens(measured).to_numpy())
+    total_rows = len(df)
+    start = 0
+    while start < total_rows:
+        base = cumulative[start - 1] if start else 0
+        end = int(np.searchsorted(cumulative, base + token_budget, side="right"))
+        end = max(end, start + 1)
+        if max_rows:
+            end = min(end, start + max_rows)
+        yield df.iloc[start:end]
+        start = end
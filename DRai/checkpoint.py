@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while block := handle.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BatchManifest:
+    """
+    記錄輸出檔的進度，存放在輸出檔旁的 JSON 檔。
+    key 包含輸入檔雜湊、筆數與分批設定，只有相同時才能接續，以確保批次邊界一致。
+    next_row 為已處理到的列數，output_offset 為最後一個寫入批次結束時的輸出檔大小，
+    failed 為重試後仍失敗、尚未寫入輸出檔的批次範圍，written 為已寫入的批次範圍（依寫入輸出檔的順序）。
+    """
+
+    def __init__(self, path: str, key: dict):
+        self.path = path
+        self.key = key
+        self.next_row = 0
+        self.output_offset = 0
+        self.failed = []
+        self.written = []
+
+    @classmethod
+    def open(cls, path: str, key: dict, resume: bool) -> "BatchManifest":
+        """
+        接續執行且 key 相同時載入既有進度，否則回傳新的 manifest。
+        """
+        manifest = cls(path, key)
+        if not resume or not os.path.exists(path):
+            return manifest
+        with open(path, encoding="utf-8") as handle:
+            saved = json.load(handle)
+        if saved.get("key") != key:
+            print(f"{path} 對應的輸入檔或分批設定不同，從頭開始。")
+            return manifest
+        if "written" not in saved:
+            print(f"{path} 未記錄批次寫入順序（舊版格式），從頭開始。")
+            return manifest
+        manifest.next_row = saved["next_row"]
+        manifest.output_offset = saved["output_offset"]
+        manifest.failed = [tuple(batch_range) for batch_range in saved["failed"]]
+        manifest.written = [tuple(batch_range) for batch_range in saved["written"]]
+        return manifest
+
+    def is_pending(self, start: int, end: int) -> bool:
+        return start >= self.next_row or (start, end) in self.failed
+
+    def mark_written(self, start: int, end: int, output_offset: int):
+        if (start, end) in self.failed:
+            self.failed.remove((start, end))
+        self.written.append((start, end))
+        self.next_row = max(self.next_row, end)
+        self.output_offset = output_offset
+        self._save()
+
+    def mark_failed(self, start: int, end: int):
+        if (start, end) not in self.failed:
+            self.failed.append((start, end))
+        self.next_row = max(self.next_row, end)
+        self._save()
+
+    def mark_rewritten(self, output_offset: int):
+        """
+        輸出檔依輸入順序整份重寫後記錄新的大小。
+        """
+        self.written.sort()
+        self.output_offset = output_offset
+        self._save()
+
+    def input_order(self) -> list:
+        """
+        輸出檔各列依輸入順序排列時的位置：重試的批次附加在較後的批次之後，依批次範圍排回原位。
+        """
+        spans = []
+        offset = 0
+        for start, end in self.written:
+            spans.append((start, offset, end - start))
+            offset += end - start
+        return [position for _, offset, length in sorted(spans) for position in range(offset, offset + length)]
+
+    def _save(self):
+        payload = {
+            "key": self.key,
+            "next_row": self.next_row,
+            "output_offset": self.output_offset,
+            "failed": sorted(self.failed),
+            "written": self.written,
+        }
+        # 先寫入暫存檔再取代，程式中斷時不會留下寫到一半的 manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+
+from google.genai.errors import APIError
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    429（額度用盡，google-genai 歸為 ClientError）與 5xx（ServerError）可退避後重試，其餘錯誤直接拋出。
+    """
+    return isinstance(exc, APIError) and (exc.code == 429 or 500 <= (exc.code or 0) < 600)
+
+
+class AdaptiveRateLimiter:
+    """
+    限制同時進行中的 API 請求數，並讓相鄰請求至少間隔 min_interval 秒。
+    收到可重試的錯誤（429 額度或 503 等 5xx 過載）時並行上限減半、間隔加倍；
+    同時失敗的請求只退避一次，之後每連續成功 limit 次，並行上限加一、間隔減半，逐步回到設定值。
+    """
+
+    def __init__(self, max_concurrency: int = 4, min_interval: float = 0.25, max_interval: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.limit = self.max_concurrency
+        self.interval = min_interval
+        self._in_flight = 0
+        self._successes = 0
+        self._next_start = 0.0
+        self._cooldown_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+            start = max(loop.time(), self._next_start)
+            self._next_start = start + self.interval
+        await asyncio.sleep(start - loop.time())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._in_flight -= 1
+            if exc is not None and is_retryable(exc):
+                self.backoff()
+            elif exc_type is None:
+                self.success()
+            self._cond.notify_all()
+        return False
+
+    def backoff(self):
+        now = asyncio.get_running_loop().time()
+        if now < self._cooldown_until:
+            return
+        self.limit = max(1, self.limit // 2)
+        self.interval = min(self.max_interval, max(self.interval, 1.0) * 2)
+        self._successes = 0
+        self._next_start = max(self._next_start, now + self.interval)
+        self._cooldown_until = now + self.interval
+        print(f"API 過載，並行上限降為 {self.limit}，請求間隔 {self.interval:.1f} 秒")
+
+    def success(self):
+        self._successes += 1
+        if self._successes >= self.limit:
+            self._successes = 0
+            self.limit = min(self.max_concurrency, self.limit + 1)
+            self.interval = max(self.min_interval, self.interval / 2)
+
+
+async def map_in_order(func, items, window: int):
+    """
+    對 items 逐一呼叫 async 函式 func，最多同時排入 window 個任務，
+    並依輸入順序 yield 結果；較早的任務尚未完成時，後面已完成的結果會先暫存。
+    """
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,4 +1,7 @@
+import asyncio
 import os
+from collections import Counter
+from dataclasses import dataclass, field
 from datetime import datetime
 import requests
 import gradio as gr
@@ -6,12 +9,19 @@ import pandas as pd
 from dotenv import load_dotenv
 from fpdf import FPDF
 from google import genai
+from google.genai.errors import APIError
 import re
 
+from batching import split_by_tokens, token_budget_for
+from dispatch import AdaptiveRateLimiter, is_retryable, map_in_order
+from labels import ITEMS, LabelMatrix
+from loaders import load_csv
+
 # 載入環境變數並設定 API 金鑰
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=api_key)
+MODEL_NAME = "gemini-2.5-pro-exp-03-25"
 
 def get_chinese_font_file() -> str:
     """
@@ -93,6 +103,73 @@ def parse_markdown_table(markdown_text: str) -> pd.DataFrame:
     df = pd.DataFrame(data, columns=headers)
     return df
 
+# 區塊表格中代表分類名稱與次數的欄位
+CATEGORY_COLUMNS = ("分類", "類別", "項目", "類型", "category", "Category")
+COUNT_COLUMNS = ("次數", "數量", "句數", "筆數", "count", "Count")
+# 逐句表格中以項目為欄位時，這些值表示未觸及
+EMPTY_MARKS = {"", "0", "-", "否", "無", "x", "X"}
+# 模型統計表中的合計列，不是分類
+TOTAL_LABELS = {"總計", "合計", "小計", "總數", "Total", "total", "Sum", "sum"}
+
+def split_markdown_tables(text: str) -> list:
+    """
+    將文字中每段連續的 Markdown 表格分別解析成 DataFrame。
+    """
+    tables = []
+    current = []
+    for line in text.splitlines() + [""]:
+        if line.strip().startswith("|"):
+            current.append(line)
+        elif current:
+            table = parse_markdown_table("\n".join(current))
+            if table is not None and not table.empty:
+                tables.append(table)
+            current = []
+    return tables
+
+def count_categories(block_text: str) -> Counter:
+    """
+    從區塊回應的表格統計各分類的句數。
+    優先採用逐句表格（分類欄或以 ITEMS 為欄位的標記），沒有時才採用模型自己的統計表（分類＋次數欄），
+    統計表中的合計列（TOTAL_LABELS）不列入分類。
+    """
+    per_row = Counter()
+    totals = Counter()
+    for table in split_markdown_tables(block_text):
+        columns = list(table.columns)
+        category_col = next((col for col in columns if col in CATEGORY_COLUMNS), None)
+        count_col = next((col for col in columns if col in COUNT_COLUMNS), None)
+        item_cols = [col for col in columns if col in ITEMS]
+        if category_col and count_col:
+            values = pd.to_numeric(table[count_col].str.extract(r"(\d+)")[0], errors="coerce")
+            for category, value in zip(table[category_col], values):
+                category = category.strip("\"'「」*： ")
+                if category and category not in TOTAL_LABELS and pd.notna(value):
+                    totals[category] += int(value)
+        elif category_col:
+            for labels in table[category_col]:
+                for label in re.split(r"[、,，/／]", labels):
+                    label = label.strip("\"'「」*： ")
+                    if label and label not in TOTAL_LABELS:
+                        per_row[label] += 1
+        elif item_cols:
+            for col in item_cols:
+                per_row[col] += int((~table[col].str.strip().isin(EMPTY_MARKS)).sum())
+    return per_row or totals
+
+def counts_table(counts: Counter, total_rows: int) -> pd.DataFrame:
+    """
+    由累計次數產生統計表，ITEMS 依原順序排在前面，其餘分類依次數排序；
+    total_rows 為成功分析的區塊句數，比例以此為分母。
+    """
+    categories = [item for item in ITEMS if item in counts]
+    categories += [category for category, _ in counts.most_common() if category not in ITEMS]
+    return pd.DataFrame({
+        "項目": categories,
+        "句數": [counts[category] for category in categories],
+        "比例": [f"{counts[category] / total_rows:.1%}" if total_rows else "" for category in categories],
+    })
+
 def generate_pdf(text: str = None, df: pd.DataFrame = None) -> str:
     print("開始生成 PDF")
     pdf = FPDF(format="A4")
@@ -110,6 +187,10 @@ def generate_pdf(text: str = None, df: pd.DataFrame = None) -> str:
     
     if df is not None:
         create_table(pdf, df)
+        # 同時提供表格與文字時，文字（例如摘要）接在表格之後
+        if text:
+            pdf.ln(5)
+            pdf.multi_cell(0, 10, text)
     elif text is not None:
         # 嘗試檢查 text 是否包含 Markdown 表格格式
         if "|" in text:
@@ -131,50 +212,145 @@ def generate_pdf(text: str = None, df: pd.DataFrame = None) -> str:
     print("PDF 生成完成")
     return pdf_filename
 
-def gradio_handler(csv_file, user_prompt):
+@dataclass
+class BlockResult:
+    block_no: int
+    row_start: int
+    row_end: int
+    text: str
+    # 從區塊表格解析出的各分類句數
+    counts: Counter = field(default_factory=Counter)
+    # 重試後仍失敗的區塊沒有分類次數，不列入比例的分母
+    failed: bool = False
+
+async def analyze_block(block_no: int, row_start: int, block: pd.DataFrame, user_prompt: str,
+                        limiter: AdaptiveRateLimiter, retries: int) -> BlockResult:
+    """
+    以 async API 分析一個區塊並解析分類次數；遇到 429 或 5xx 錯誤時由 limiter 退避後重試，仍失敗則回傳錯誤訊息。
+    """
+    row_end = row_start + len(block)
+    block_csv = block.to_csv(index=False)
+    prompt = (f"以下是CSV資料第 {row_start+1} 到 {row_end} 筆：\n"
+              f"{block_csv}\n\n請根據以下規則進行分析並產出報表：\n{user_prompt}")
+    print(f"送出區塊 {block_no}（第 {row_start+1} 到 {row_end} 筆）")
+    for attempt in range(1, retries + 1):
+        try:
+            async with limiter:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=[prompt]
+                )
+            text = response.text.strip()
+            return BlockResult(block_no, row_start, row_end, text, count_categories(text))
+        except APIError as e:
+            if not is_retryable(e):
+                raise
+            print(f"區塊 {block_no} API 呼叫失敗（第 {attempt}/{retries} 次）：{e}")
+    return BlockResult(block_no, row_start, row_end, f"（區塊分析失敗，已重試 {retries} 次）", failed=True)
+
+async def summarize_counts(summary: pd.DataFrame, total_rows: int, user_prompt: str,
+                           limiter: AdaptiveRateLimiter) -> str:
+    """
+    只把統計表交給 LLM 撰寫文字摘要，不再重送各區塊的內容。
+    """
+    prompt = (f"以下是 {total_rows} 句逐字稿依規則分類後的統計表：\n"
+              f"{summary.to_csv(index=False)}\n"
+              f"分類規則：\n{user_prompt}\n\n"
+              "請根據統計結果撰寫一段簡短的文字摘要，不需要重新列出表格。")
+    try:
+        async with limiter:
+            response = await client.aio.models.generate_content(
+                model=MODEL_NAME,
+                contents=[prompt]
+            )
+        return response.text.strip()
+    except APIError as e:
+        if not is_retryable(e):
+            raise
+        print(f"摘要 API 呼叫失敗：{e}")
+        return "（摘要產生失敗）"
+
+async def gradio_handler(csv_file, user_prompt):
     print("進入 gradio_handler")
     if csv_file is not None:
         print("讀取 CSV 檔案")
-        df = pd.read_csv(csv_file.name)
+        df = load_csv(csv_file.name)
         total_rows = df.shape[0]
-        block_size = 30
+        # 已含編碼欄位的 DRai 輸出直接在本地統計，不呼叫 LLM
+        if all(item in df.columns for item in ITEMS):
+            summary = LabelMatrix.from_frame(df, session=os.path.basename(csv_file.name)).summary()
+            response_text = f"共 {total_rows} 句\n\n" + summary.to_string(index=False)
+            pdf_path = await asyncio.to_thread(generate_pdf, df=summary)
+            yield response_text, pdf_path
+            return
+        # 依 token 預算切分區塊，BLOCK_MAX_ROWS 限制每區塊筆數以免輸出表格過長
+        token_budget = token_budget_for(MODEL_NAME)
+        max_rows = int(os.getenv("BLOCK_MAX_ROWS", "120"))
+        blocks = []
+        row_end = 0
+        for block in split_by_tokens(df, token_budget, max_rows):
+            blocks.append((len(blocks) + 1, row_end, block))
+            row_end += len(block)
+        # BLOCK_CONCURRENCY 個區塊同時送出，結果依區塊順序逐一顯示
+        concurrency = int(os.getenv("BLOCK_CONCURRENCY", "4"))
+        limiter = AdaptiveRateLimiter(
+            max_concurrency=concurrency,
+            min_interval=float(os.getenv("BLOCK_MIN_INTERVAL", "0.5")),
+        )
+        retries = int(os.getenv("BLOCK_RETRIES", "3"))
+
+        async def analyze(numbered):
+            return await analyze_block(*numbered, user_prompt, limiter, retries)
+
+        # 每個區塊只保留一份回應文字，分類次數在本地累計
         cumulative_response = ""
-        block_responses = []
-        # 依區塊處理 CSV 並依每區塊呼叫 LLM 產生報表分析結果
-        for i in range(0, total_rows, block_size):
-            block = df.iloc[i:i+block_size]
-            block_csv = block.to_csv(index=False)
-            prompt = (f"以下是CSV資料第 {i+1} 到 {min(i+block_size, total_rows)} 筆：\n"
-                      f"{block_csv}\n\n請根據以下規則進行分析並產出報表：\n{user_prompt}")
-            print("完整 prompt for block:")
-            print(prompt)
-            response = client.models.generate_content(
-                model="gemini-2.5-pro-exp-03-25",
-                contents=[prompt]
-            )
-            block_response = response.text.strip()
-            cumulative_response += f"區塊 {i//block_size+1}:\n{block_response}\n\n"
-            block_responses.append(cumulative_response)
-            # 可考慮 yield 逐步更新（此處示範最終一次回傳）
-        # 將所有區塊回應合併，並生成漂亮表格 PDF
-        pdf_path = generate_pdf(text=cumulative_response)
-        return cumulative_response, pdf_path
+        counts = Counter()
+        parsed_rows = 0
+        failed_blocks = []
+        yield f"共 {len(blocks)} 個區塊，分析中…", None
+        async for result in map_in_order(analyze, blocks, window=concurrency * 2):
+            cumulative_response += f"區塊 {result.block_no}:\n{result.text}\n\n"
+            counts.update(result.counts)
+            if result.failed:
+                failed_blocks.append(result)
+            else:
+                parsed_rows += result.row_end - result.row_start
+            yield cumulative_response + f"（已完成 {result.block_no} / {len(blocks)} 個區塊）", None
+        if not counts:
+            # 回應中沒有可解析的分類表格時，沿用原本以全部回應產生 PDF 的方式
+            pdf_path = await asyncio.to_thread(generate_pdf, text=cumulative_response)
+            yield cumulative_response, pdf_path
+            return
+        # 統計表由累計次數產生，只有文字摘要需要再呼叫一次 LLM
+        summary = counts_table(counts, parsed_rows)
+        report = f"共 {total_rows} 句"
+        if failed_blocks:
+            ranges = "、".join(f"區塊 {result.block_no}（第 {result.row_start + 1} 到 {result.row_end} 筆）"
+                              for result in failed_blocks)
+            report += f"，其中 {parsed_rows} 句分析成功，比例以此計算\n以下區塊分析失敗，未列入統計：{ranges}"
+        report += "\n\n" + summary.to_string(index=False)
+        yield cumulative_response + report + "\n\n（撰寫摘要中…）", None
+        narrative = await summarize_counts(summary, parsed_rows, user_prompt, limiter)
+        if failed_blocks:
+            narrative += f"\n\n以下區塊分析失敗，未列入統計：{ranges}"
+        pdf_path = await asyncio.to_thread(generate_pdf, text=narrative, df=summary)
+        yield cumulative_response + report + "\n\n" + narrative, pdf_path
     else:
         context = "未上傳 CSV 檔案。"
         full_prompt = f"{context}\n\n{user_prompt}"
         print("完整 prompt：")
         print(full_prompt)
     
-        response = client.models.generate_content(
-            model="gemini-2.5-pro-exp-03-25",
+        response = await client.aio.models.generate_content(
+            model=MODEL_NAME,
             contents=[full_prompt]
         )
         response_text = response.text.strip()
         print("AI 回應：")
         print(response_text)
     
-        pdf_path = generate_pdf(text=response_text)
-        return response_text, pdf_path
+        pdf_path = await asyncio.to_thread(generate_pdf, text=response_text)
+        yield response_text, pdf_path
 
 default_prompt = """請根據以下的規則將每句對話進行分類：
 
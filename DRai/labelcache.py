@@ -0,0 +1,102 @@
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+
+
+def normalize_utterance(text: str) -> str:
+    """
+    正規化逐字稿句子：全形轉半形（例如「？」與「?」視為相同）並合併空白。
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def scheme_version(items: list) -> str:
+    """
+    編碼項目的版本號；ITEMS 增刪或改名時版本隨之改變，舊的快取結果不再被使用。
+    """
+    return hashlib.sha256(json.dumps(items, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+class LabelCache:
+    """
+    以 SQLite 保存逐句編碼結果，鍵為正規化後的句子、編碼項目版本與模型名稱的雜湊。
+    path 為 None 時不使用快取，所有句子都照原樣送出。
+    """
+
+    def __init__(self, path: str | None, model: str, scheme: str):
+        self.path = path
+        self.model = model
+        self.scheme = scheme
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                " key TEXT PRIMARY KEY, utterance TEXT, model TEXT, scheme TEXT, labels TEXT)"
+            )
+
+    def key(self, utterance: str) -> str:
+        text = f"{self.scheme}\0{self.model}\0{normalize_utterance(utterance)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, dialogues: list) -> tuple[list, list]:
+        """
+        回傳 (cached, misses)：cached 為每句的快取結果（未命中為 None），
+        misses 為需要送出的句子，同一批中重複的句子只送一次。
+        """
+        if self._db is None:
+            return [None] * len(dialogues), list(dialogues)
+        keys = [self.key(text) for text in dialogues]
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # SQLite 單一查詢的參數數量有限，分段查詢
+        for i in range(0, len(unique_keys), 500):
+            part = unique_keys[i:i + 500]
+            rows = self._db.execute(
+                f"SELECT key, labels FROM labels WHERE key IN ({','.join('?' * len(part))})", part
+            )
+            found.update((key, json.loads(labels)) for key, labels in rows)
+        cached = [found.get(key) for key in keys]
+        misses = []
+        missed_keys = set()
+        for text, key, result in zip(dialogues, keys, cached):
+            if result is None and key not in missed_keys:
+                missed_keys.add(key)
+                misses.append(text)
+        hit_count = sum(result is not None for result in cached)
+        self.hits += hit_count
+        self.misses += len(dialogues) - hit_count
+        return cached, misses
+
+    def merge(self, dialogues: list, cached: list, misses: list, miss_results: list | None) -> list | None:
+        """
+        將送出句子的結果存入快取，並依原順序與快取結果合併；miss_results 為 None 表示批次失敗。
+        miss_results 中部分為 None（這幾句沒有有效結果）時，其餘結果仍存入快取，整批回傳 None 列入重試清單，
+        重試時只有沒有結果的句子需要送出。
+        """
+        if miss_results is None:
+            return None
+        complete = all(result is not None for result in miss_results)
+        if self._db is None:
+            return miss_results if complete else None
+        rows = [(self.key(text), text, result) for text, result in zip(misses, miss_results) if result is not None]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+                [
+                    (key, normalize_utterance(text), self.model, self.scheme, json.dumps(result, ensure_ascii=False))
+                    for key, text, result in rows
+                ],
+            )
+        if not complete:
+            return None
+        by_key = {key: result for key, _, result in rows}
+        return [result if result is not None else by_key[self.key(text)] for text, result in zip(dialogues, cached)]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
@@ -0,0 +1,173 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# 定義評分項目（依據原始 xlsx 編碼規則）
+ITEMS = [
+    "引導",
+    "評估(口語、跟讀的內容有關)",
+    "評估(非口語、寶寶自發性動作、跟讀的內容有關)",
+    "延伸討論",
+    "複述",
+    "開放式問題",
+    "填空",
+    "回想",
+    "人事時地物問句",
+    "連結生活經驗",
+    "備註"
+]
+
+
+def _marked(values) -> np.ndarray:
+    """
+    1、"1"、True（或 "1.0" 等數值為 1 的值）視為觸及，其餘為未觸及。
+    """
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").eq(1).to_numpy()
+
+
+class LabelMatrix:
+    """
+    逐句編碼結果的 uint8 矩陣（列為逐字稿、欄依 items 排列，1 表示觸及），
+    sessions 為每列所屬的場次（例如來源檔名），統計全部以 NumPy 向量運算完成，不需呼叫 LLM。
+    """
+
+    def __init__(self, values: np.ndarray, items: list = ITEMS, sessions: np.ndarray | None = None):
+        self.values = np.asarray(values, dtype=np.uint8).reshape(-1, len(items))
+        self.items = list(items)
+        if sessions is None:
+            sessions = np.full(len(self.values), "", dtype=object)
+        self.sessions = np.asarray(sessions, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @classmethod
+    def from_results(cls, results: list, items: list = ITEMS, session: str = "") -> "LabelMatrix":
+        """
+        由 {項目: 值} 的結果清單建立矩陣；分隔線格式的回覆可能是數字或布林值，與 from_frame 相同方式判斷。
+        """
+        if not results:
+            return cls(np.zeros((0, len(items))), items)
+        values = np.column_stack([_marked([result.get(item) for result in results]) for item in items])
+        return cls(values, items, np.full(len(results), session, dtype=object))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, items: list = ITEMS, session: str = "",
+                   session_col: str | None = None) -> "LabelMatrix":
+        """
+        由 DRai 輸出的 DataFrame 建立矩陣；欄位值為 1（字串或數字）視為觸及，其餘為未觸及。
+        session_col 指定時以該欄作為場次，否則整份資料屬於 session。
+        """
+        values = np.column_stack([_marked(df[item]) for item in items])
+        sessions = df[session_col].astype(str).to_numpy(dtype=object) if session_col else None
+        if sessions is None:
+            sessions = np.full(len(df), session, dtype=object)
+        return cls(values, items, sessions)
+
+    @classmethod
+    def concat(cls, matrices: list) -> "LabelMatrix":
+        items = matrices[0].items
+        if any(matrix.items != items for matrix in matrices):
+            raise ValueError("編碼項目不同的矩陣無法合併")
+        return cls(
+            np.concatenate([matrix.values for matrix in matrices]),
+            items,
+            np.concatenate([matrix.sessions for matrix in matrices]),
+        )
+
+    def to_strings(self) -> pd.DataFrame:
+        """
+        轉回輸出 CSV 使用的 "1"/"" 字串欄位。
+        """
+        return pd.DataFrame(np.where(self.values == 1, "1", ""), columns=self.items)
+
+    def counts(self) -> pd.Series:
+        """
+        各項目觸及的句數。
+        """
+        return pd.Series(self.values.sum(axis=0, dtype=np.int64), index=self.items, name="count")
+
+    def rates(self) -> pd.Series:
+        """
+        各項目觸及的句數占總句數的比例。
+        """
+        if not len(self):
+            return pd.Series(0.0, index=self.items, name="rate")
+        return pd.Series(self.values.mean(axis=0), index=self.items, name="rate")
+
+    def cooccurrence(self) -> pd.DataFrame:
+        """
+        項目共現矩陣：第 i 列第 j 欄為同時觸及項目 i 與 j 的句數，對角線即各項目句數。
+        """
+        # 以浮點數矩陣乘法交給 BLAS 計算，句數在 2**53 以內結果精確
+        values = self.values.astype(np.float64)
+        return pd.DataFrame((values.T @ values).astype(np.int64), index=self.items, columns=self.items)
+
+    def session_rates(self) -> pd.DataFrame:
+        """
+        各場次的句數與各項目觸及比例。
+        """
+        codes, names = pd.factorize(self.sessions, sort=True)
+        utterances = np.bincount(codes, minlength=len(names))
+        sums = np.column_stack(
+            [np.bincount(codes, weights=self.values[:, i], minlength=len(names)) for i in range(len(self.items))]
+        )
+        rates = pd.DataFrame(sums / np.maximum(utterances, 1)[:, None], index=names, columns=self.items)
+        rates.insert(0, "句數", utterances)
+        return rates
+
+    def summary(self) -> pd.DataFrame:
+        """
+        報表用的統計表：各項目的句數與比例。
+        """
+        return pd.DataFrame({
+            "項目": self.items,
+            "句數": self.counts().to_numpy(),
+            "比例": [f"{rate:.1%}" for rate in self.rates()],
+        })
+
+    def save(self, path: str):
+        """
+        以位元壓縮（每列 11 個項目佔 2 bytes）存成 .npz。
+        """
+        np.savez_compressed(
+            path,
+            items=np.array(self.items),
+            bits=np.packbits(self.values, axis=1),
+            sessions=self.sessions.astype(str),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LabelMatrix":
+        with np.load(path) as data:
+            items = data["items"].tolist()
+            values = np.unpackbits(data["bits"], axis=1, count=len(items))
+            return cls(values, items, data["sessions"].astype(object))
+
+
+def load_labels(path: str, items: list = ITEMS, session_col: str | None = None) -> LabelMatrix:
+    """
+    讀取 .npz 標記檔，或 DRai 輸出的 CSV（只讀取項目欄位，場次為檔名）。
+    """
+    if path.endswith(".npz"):
+        return LabelMatrix.load(path)
+    usecols = [*items, session_col] if session_col else items
+    df = pd.read_csv(path, usecols=usecols, dtype="string")
+    return LabelMatrix.from_frame(df, items, session=os.path.basename(path), session_col=session_col)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="統計 DRai 編碼結果")
+    parser.add_argument("paths", nargs="+", help="DRai 輸出的 CSV 或 .npz 標記檔，每個檔案視為一個場次")
+    parser.add_argument("--session-col", help="以此欄位區分場次，而非以檔案區分")
+    args = parser.parse_args()
+    matrix = LabelMatrix.concat([load_labels(path, session_col=args.session_col) for path in args.paths])
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(f"共 {len(matrix)} 句")
+        print(matrix.summary().to_string(index=False))
+        print("\n共現矩陣：")
+        print(matrix.cooccurrence())
+        print("\n各場次比例：")
+        print(matrix.session_rates().round(3))
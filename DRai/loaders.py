@@ -0,0 +1,36 @@
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# 已知資料集的欄位型別：逐字稿的 start/end 是「分:秒」字串，不轉成時間
+TRANSCRIPT_DTYPES = {
+    "start": "string",
+    "end": "string",
+    "text": "string",
+    "utterance": "string",
+    "content": "string",
+    "dialogue": "string",
+    "Dialogue": "string",
+}
+
+
+def load_csv(path: str, usecols: list[str] | None = None) -> pd.DataFrame:
+    """
+    以 pyarrow 讀取 CSV，已知欄位直接給定型別，其餘欄位交由 pyarrow 推斷。
+    pandas 的 pyarrow 引擎會先推斷型別再套用 dtype，「00:01」會先被解析成時間「00:01:00」，
+    因此直接以 pyarrow 讀取並在讀檔時指定字串欄位。
+    usecols 可只讀取需要的欄位；若 pyarrow 無法解析，改用預設引擎讀取。
+    """
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    if usecols is not None:
+        columns = [col for col in columns if col in usecols]
+    dtype = {col: TRANSCRIPT_DTYPES[col] for col in columns if col in TRANSCRIPT_DTYPES}
+    try:
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pa.string() for col in dtype},
+        )
+        return pa_csv.read_csv(path, convert_options=convert_options).to_pandas().astype(dtype)
+    except (ValueError, TypeError) as e:
+        print(f"pyarrow 讀取失敗（{e}），改用預設方式讀取。")
+        return pd.read_csv(path, usecols=columns)
@@ -0,0 +1,178 @@
+import argparse
+import os
+import pickle
+import re
+
+import pandas as pd
+
+from labelcache import normalize_utterance
+
+# 只有語助詞、沒有內容的回應，所有項目皆不觸及
+FILLERS = {"嗯", "嗯嗯", "喔", "喔喔", "哦", "啊", "欸", "呃", "唉", "哇", "耶", "蛤"}
+# 句尾留空讓孩子接話，例如「小熊在吃……」「這是＿＿」（正規化後「…」為「...」、「＿」為「_」）
+TRAILING_BLANK = re.compile(r"(\.{3,}|_{2,}|○+)$")
+# 短的人事時地物問句，例如「這是什麼？」「在哪裡？」「那是誰呢？」
+WH_QUESTION = re.compile(r"^[這那你他她它]?[個是在有]{0,2}(什麼|誰|哪裡|哪個|幾個|多少)[呢啊呀]?$")
+# 短的開放式問題，例如「為什麼呢？」「你覺得呢？」
+OPEN_QUESTION = re.compile(r"^(為什麼|怎麼了|怎麼辦|你覺得)[呢啊呀]?$")
+# 規則只判斷字數不超過此值的短句，較長的句子可能同時觸及其他項目
+RULE_MAX_CHARS = 8
+
+
+def rule_labels(text: str, items: list) -> dict | None:
+    """
+    以規則判斷一句逐字稿；只有能確定所有項目時才回傳結果，否則回傳 None。
+    """
+    normalized = normalize_utterance(text)
+    core = re.sub(r"[\W_]+", "", normalized)
+    labels = {item: "" for item in items}
+    if not core or core in FILLERS:
+        return labels
+    if len(core) > RULE_MAX_CHARS:
+        return None
+    if TRAILING_BLANK.search(normalized) and "填空" in labels:
+        labels["填空"] = "1"
+        return labels
+    if normalized.endswith("?"):
+        if WH_QUESTION.match(core) and "人事時地物問句" in labels:
+            labels["人事時地物問句"] = "1"
+            return labels
+        if OPEN_QUESTION.match(core) and "開放式問題" in labels:
+            labels["開放式問題"] = "1"
+            return labels
+    return None
+
+
+class LabelModel:
+    """
+    以過去的 113_batch.csv 訓練的字元 n-gram TF-IDF 與逐項目邏輯斯迴歸，需安裝 scikit-learn。
+    訓練資料中只有單一值的項目直接預測該值。
+    """
+
+    def __init__(self, items: list, vectorizer, classifiers: dict):
+        self.items = items
+        self.vectorizer = vectorizer
+        self.classifiers = classifiers
+
+    @classmethod
+    def train(cls, frames: list, items: list, text_col: str = "text") -> "LabelModel":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+
+        df = pd.concat(frames, ignore_index=True)
+        texts = df[text_col].astype("string").fillna("").map(normalize_utterance)
+        vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(1, 3), min_df=2, sublinear_tf=True)
+        features = vectorizer.fit_transform(texts)
+        classifiers = {}
+        for item in items:
+            target = pd.to_numeric(df[item], errors="coerce").fillna(0).eq(1).to_numpy()
+            if target.all() or not target.any():
+                classifiers[item] = bool(target[0])
+                continue
+            classifiers[item] = LogisticRegression(max_iter=1000, class_weight="balanced").fit(features, target)
+        return cls(items, vectorizer, classifiers)
+
+    def predict(self, texts: list, confidence: float) -> list:
+        """
+        回傳每句的結果；任一項目的機率介於 1 - confidence 與 confidence 之間則為 None。
+        """
+        if not texts:
+            return []
+        features = self.vectorizer.transform([normalize_utterance(text) for text in texts])
+        probabilities = {}
+        for item, classifier in self.classifiers.items():
+            if isinstance(classifier, bool):
+                probabilities[item] = [float(classifier)] * len(texts)
+            else:
+                probabilities[item] = classifier.predict_proba(features)[:, 1]
+        results = []
+        for row in range(len(texts)):
+            row_probabilities = {item: probabilities[item][row] for item in self.items}
+            if all(p >= confidence or p <= 1 - confidence for p in row_probabilities.values()):
+                results.append({item: "1" if p >= confidence else "" for item, p in row_probabilities.items()})
+            else:
+                results.append(None)
+        return results
+
+    def save(self, path: str):
+        with open(path, "wb") as handle:
+            pickle.dump(self, handle)
+
+    @staticmethod
+    def load(path: str) -> "LabelModel":
+        with open(path, "rb") as handle:
+            return pickle.load(handle)
+
+
+class PreClassifier:
+    """
+    送出 LLM 前的本地預分類：先套用規則，再以 LabelModel（若有）判斷，
+    兩者都無法確定的句子才送至 Gemini，並統計各階段處理的句數。
+    """
+
+    def __init__(self, items: list, rules: bool = True, model: LabelModel | None = None, confidence: float = 0.97):
+        self.items = items
+        self.rules = rules
+        self.model = model
+        self.confidence = confidence
+        self.total = 0
+        self.rule_hits = 0
+        self.model_hits = 0
+
+    def classify(self, dialogues: list) -> list:
+        """
+        回傳每句的本地結果，無法確定的句子為 None。
+        """
+        results = [rule_labels(text, self.items) if self.rules else None for text in dialogues]
+        self.total += len(dialogues)
+        self.rule_hits += sum(result is not None for result in results)
+        if self.model is not None:
+            undecided = [i for i, result in enumerate(results) if result is None]
+            predictions = self.model.predict([dialogues[i] for i in undecided], self.confidence)
+            for i, prediction in zip(undecided, predictions):
+                if prediction is not None:
+                    results[i] = prediction
+                    self.model_hits += 1
+        return results
+
+    @property
+    def local_hits(self) -> int:
+        return self.rule_hits + self.model_hits
+
+
+def pre_classifier_from_env(items: list) -> PreClassifier:
+    """
+    PREFILTER_RULES=0 停用規則；PREFILTER_MODEL 為 LabelModel 檔案路徑（預設 prefilter_model.pkl，存在才載入）；
+    PREFILTER_CONFIDENCE 為模型結果採用的最低機率。
+    """
+    model_path = os.environ.get("PREFILTER_MODEL", "prefilter_model.pkl")
+    model = None
+    if model_path and os.path.exists(model_path):
+        try:
+            model = LabelModel.load(model_path)
+        except ImportError:
+            print(f"未安裝 scikit-learn，略過 {model_path}，只使用規則預分類。")
+    if model is not None and model.items != items:
+        print(f"{model_path} 的編碼項目與目前不同，請重新訓練；只使用規則預分類。")
+        model = None
+    return PreClassifier(
+        items,
+        rules=os.environ.get("PREFILTER_RULES", "1") != "0",
+        model=model,
+        confidence=float(os.environ.get("PREFILTER_CONFIDENCE", "0.97")),
+    )
+
+
+if __name__ == "__main__":
+    from labels import ITEMS
+    # 經由模組名稱使用 LabelModel，pickle 才會記錄為 prefilter.LabelModel 而非 __main__.LabelModel
+    import prefilter
+
+    parser = argparse.ArgumentParser(description="以過去的編碼結果訓練本地預分類模型")
+    parser.add_argument("csv_files", nargs="+", help="DRai.py 輸出的結果 CSV，例如 113_batch.csv")
+    parser.add_argument("--output", default="prefilter_model.pkl", help="模型輸出路徑")
+    parser.add_argument("--text-col", default="text", help="逐字稿欄位名稱")
+    args = parser.parse_args()
+    frames = [pd.read_csv(path, usecols=[args.text_col, *ITEMS]) for path in args.csv_files]
+    prefilter.LabelModel.train(frames, ITEMS, args.text_col).save(args.output)
+    print(f"已訓練 {sum(len(frame) for frame in frames)} 筆，模型寫入：{args.output}")
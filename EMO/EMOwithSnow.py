@@ -12,8 +12,9 @@ def generate_mood_trend_plot(user_id, user_entries):
     output_dir = "static/moodtrend"
     os.makedirs(output_dir, exist_ok=True)
 
-    # 轉換日期格式並排序
-    user_entries["日期"] = pd.to_datetime(user_entries["日期"])
+    # 日期已在 load_diary 讀檔時解析，只有退回原本讀法時才需要轉換
+    if not pd.api.types.is_datetime64_any_dtype(user_entries["日期"]):
+        user_entries["日期"] = pd.to_datetime(user_entries["日期"])
     user_entries = user_entries.sort_values("日期")
     # 轉換心情指數為數字
     user_entries["心情指數"] = pd.to_numeric(user_entries["心情指數"], errors="coerce")
@@ -2,7 +2,6 @@ import os
 import asyncio
 import json
 import threading
-import pandas as pd
 from dotenv import load_dotenv, find_dotenv
 from flask import Flask, render_template, request
 from flask_socketio import SocketIO, emit
@@ -12,6 +11,7 @@ from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.messages import TextMessage
 from EMOwithSnow import generate_mood_trend_plot
+from loaders import load_diary
 
 # ✅ 初始化 Flask 與 SocketIO
 app = Flask(__name__)
@@ -83,7 +83,7 @@ def upload_file():
 
 def background_task(file_path):
     try:
-        df = pd.read_csv(file_path)
+        df = load_diary(file_path)
         user_id = os.path.splitext(os.path.basename(file_path))[0]
         plot_path = generate_mood_trend_plot(user_id, df)
         socketio.emit('plot_generated', {'plot_url': '/' + plot_path})
@@ -0,0 +1,31 @@
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# ✅ 心情日記的欄位型別：天氣為少數固定值，日期只在讀檔時解析一次
+DIARY_DTYPES = {
+    "當日天氣": "category",
+    "心情小語": "string",
+}
+DIARY_DATES = ["日期"]
+DIARY_COLUMNS = ["用戶ID", "日期", "當日天氣", "心情指數", "心情小語"]
+
+
+def load_diary(file_path):
+    columns = list(pd.read_csv(file_path, nrows=0).columns)
+    usecols = [col for col in columns if col in DIARY_COLUMNS] or columns
+    dtype = {col: dtype for col, dtype in DIARY_DTYPES.items() if col in usecols}
+    dates = [col for col in DIARY_DATES if col in usecols]
+    try:
+        # ✅ 直接以 pyarrow 讀取並指定字串欄位，避免 pandas 的 pyarrow 引擎先把文字推斷成數字或時間
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types={col: pa.string() for col in [*dtype, *dates]},
+        )
+        df = pa_csv.read_csv(file_path, convert_options=convert_options).to_pandas().astype(dtype)
+        for col in dates:
+            df[col] = pd.to_datetime(df[col])
+        return df
+    except (ValueError, TypeError):
+        # ✅ 格式不符時退回原本的讀法
+        return pd.read_csv(file_path)
@@ -0,0 +1,421 @@
+"""Offline throughput benchmark for the chunked CSV analysis pipeline.
+
+Drives the same path as ``dataAgent`` and ``multiDataAgent`` (lazy CSV
+ingest, ``ChunkScheduler``, ``TeamPool`` and real ``RoundRobinGroupChat``
+teams) with a deterministic fake model client and a stub web surfer, over
+synthetic baby-diary CSVs. Every combination of row count, chunk size and
+concurrency runs in its own process and reports rows/s, peak RSS,
+p50/p99 chunk latency and the number of chunks that failed on an injected
+model error (``--error-rate``). No API key or network access is needed.
+
+    python benchmark.py --rows 1000 100000 --chunk-sizes 100 1000 --concurrency 1 4
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import product
+from multiprocessing import get_context
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+from autogen_agentchat.agents import BaseChatAgent, UserProxyAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+
+import dataAgent
+from budgets import ChunkBudget
+from pool import TeamPool
+from scheduler import ChunkScheduler, ModelRateLimiter, ScheduledJob
+from tokens import estimate_tokens
+
+
+class FakeChatCompletionClient(ChatCompletionClient):
+    """A seeded stand-in for ``OpenAIChatCompletionClient``.
+
+    Each call sleeps for a log-normally distributed latency, reports the
+    estimated prompt tokens and a fixed completion size, and fails with
+    probability ``error_rate``.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 50,
+        latency_sigma: float = 0.5,
+        completion_tokens: int = 80,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._model_info = ModelInfo(
+            vision=False,
+            function_calling=True,
+            json_output=False,
+            family="fake",
+            structured_output=False,
+        )
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Any] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> CreateResult:
+        delay = self._random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+        failed = self._random.random() < self.error_rate
+        await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError("Injected model error")
+        usage = RequestUsage(prompt_tokens=self.count_tokens(messages), completion_tokens=self.completion_tokens)
+        self._actual_usage = usage
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + usage.completion_tokens,
+        )
+        content = ("The batch shows a regular feeding and sleep pattern. " * self.completion_tokens)[
+            : self.completion_tokens * 4
+        ]
+        return CreateResult(finish_reason="stop", content=content, usage=usage, cached=False)
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Any] = [],
+        tool_choice: Any = "auto",
+        json_output: Any = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        yield await self.create(messages, cancellation_token=cancellation_token)
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._actual_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Any] = []) -> int:
+        return sum(estimate_tokens(str(message.content)) for message in messages)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Any] = []) -> int:
+        return 1_000_000 - self.count_tokens(messages)
+
+    @property
+    def capabilities(self) -> ModelInfo:
+        return self._model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._model_info
+
+
+class StubWebSurfer(BaseChatAgent):
+    """Replaces ``MultimodalWebSurfer``: answers after a fixed delay without a browser."""
+
+    def __init__(self, name: str, model_client: ChatCompletionClient, latency_ms: float = 200) -> None:
+        super().__init__(name, "A stub web surfer for benchmarks.")
+        self.latency_ms = latency_ms
+
+    @property
+    def produced_message_types(self) -> Sequence[type[BaseChatMessage]]:
+        return (TextMessage,)
+
+    async def on_messages(
+        self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken
+    ) -> Response:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return Response(
+            chat_message=TextMessage(
+                content="Search results: recent guidance on infant sleep and feeding schedules.",
+                source=self.name,
+            )
+        )
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+EVENT_TYPES = np.array(["sleep", "diaper", "nursing", "bottle", "pumping", "solids"])
+EVENT_WEIGHTS = np.array([58, 38, 34, 30, 20, 18]) / 198
+
+
+def _details(event_type: str, rng: random.Random) -> str:
+    if event_type == "sleep":
+        return json.dumps({"duration": f"P0Y0M0DT{rng.randint(0, 8)}H{rng.randint(0, 59)}M0S", "use_timer": True})
+    if event_type == "diaper":
+        return json.dumps({"type": rng.choice(["pee", "poo", "mixed"]), "shape": "", "appearance": ""})
+    if event_type == "nursing":
+        return json.dumps(
+            {
+                "left": {"duration": f"P0Y0M0DT0H{rng.randint(0, 20)}M0S"},
+                "right": {"duration": f"P0Y0M0DT0H{rng.randint(0, 20)}M0S"},
+                "use_timer": True,
+            }
+        )
+    if event_type == "bottle":
+        return json.dumps(
+            {"type": rng.choice(["formula", "breast_milk"]), "volume": rng.randrange(60, 240, 10), "user_unit_preference": "ml"}
+        )
+    if event_type == "pumping":
+        return json.dumps(
+            {
+                "left": {"volume": rng.randrange(0, 150, 10), "duration": "P0Y0M0DT0H10M0S"},
+                "right": {"volume": rng.randrange(0, 150, 10), "duration": "P0Y0M0DT0H10M0S"},
+                "use_timer": True,
+                "user_unit_preference": "ml",
+            }
+        )
+    return json.dumps(
+        {"foods": [{"type": "rice porridge 30g"}], "allergy": rng.random() < 0.05, "reaction": rng.choice(["happy", "neutral"])}
+    )
+
+
+def write_synthetic_diary(path: str, rows: int, seed: int = 0, block_rows: int = 100_000) -> None:
+    """Write ``rows`` diary events with the columns of ``cuboai_baby_diary.csv``."""
+    rng = np.random.default_rng(seed)
+    details_rng = random.Random(seed)
+    first = True
+    for block_start in range(0, rows, block_rows):
+        n = min(block_rows, rows - block_start)
+        profile_id = rng.integers(1, 200, n)
+        event_type = rng.choice(EVENT_TYPES, n, p=EVENT_WEIGHTS)
+        start = pd.Timestamp("2024-08-16") + pd.to_timedelta(rng.integers(0, 365 * 86400, n), unit="s")
+        end = start + pd.to_timedelta(rng.integers(0, 4 * 3600, n), unit="s")
+        block = pd.DataFrame(
+            {
+                "profile_id": profile_id,
+                "gender": np.where(profile_id % 2, "boy", "girl"),
+                "預產？": 0,
+                "預產期": "",
+                "birthdate": "2024-07-31",
+                "encrypted_device_id": "",
+                "event_id": np.arange(block_start + 1, block_start + n + 1),
+                "event_type": event_type,
+                "start_time": start.strftime("%Y-%m-%d %H:%M:%S"),
+                "end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+                "note": np.where(rng.random(n) < 0.05, "needs follow-up", ""),
+                "details": [_details(kind, details_rng) for kind in event_type],
+                "is_deleted": 0,
+                "created_at": start.strftime("%Y-%m-%d %H:%M:%S"),
+                "type_name": "",
+            }
+        )
+        block.to_csv(path, mode="w" if first else "a", header=first, index=False, encoding="utf-8")
+        first = False
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def _settle(factory: Callable[[], Awaitable[Any]]) -> Any:
+    try:
+        return await factory()
+    except Exception as exc:
+        return exc
+
+
+async def _settling(jobs: AsyncIterator[ScheduledJob]) -> AsyncIterator[ScheduledJob]:
+    """Make each chunk return its exception instead of raising it.
+
+    An injected model error then costs one chunk, as a retried or skipped
+    chunk would in a real run, instead of ending the configuration.
+    """
+    async for job in jobs:
+        job.factory = partial(_settle, job.factory)
+        yield job
+
+
+async def _run_pipeline(csv_path: str, chunk_size: int, concurrency: int, options: dict[str, Any]) -> dict[str, Any]:
+    # build_team creates the web surfer and the user proxy itself, so swap
+    # in the stub surfer and a user that never waits for console input.
+    dataAgent.MultimodalWebSurfer = partial(StubWebSurfer, latency_ms=options["web_latency_ms"])
+    dataAgent.UserProxyAgent = partial(UserProxyAgent, input_func=lambda prompt: "continue")
+
+    model_client = FakeChatCompletionClient(
+        latency_ms=options["latency_ms"],
+        latency_sigma=options["latency_sigma"],
+        completion_tokens=options["completion_tokens"],
+        error_rate=options["error_rate"],
+        seed=options["seed"],
+    )
+    # One round is the task message plus a turn from each of the four agents.
+    budget = ChunkBudget(max_messages=1 + 4 * options["rounds"])
+    limiter = ModelRateLimiter()
+    scheduler = ChunkScheduler(limiter, max_concurrency=concurrency)
+    team_pool = TeamPool(lambda: dataAgent.build_team(model_client, budget), size=concurrency)
+    jobs = dataAgent.chunk_jobs(
+        csv_path,
+        chunk_size,
+        None,
+        model_client,
+        budget,
+        limiter,
+        serializer=options["serializer"],
+        team_pool=team_pool,
+    )
+
+    latencies: list[float] = []
+    rows = 0
+    chunk_errors = 0
+    error = None
+    started = time.monotonic()
+    try:
+        async for job, result in scheduler.stream(_settling(jobs)):
+            if isinstance(result, Exception):
+                chunk_errors += 1
+                continue
+            latencies.append(time.monotonic() - job.started_at)
+            batch_start, batch_end = job.context
+            rows += batch_end - batch_start + 1
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    finally:
+        await team_pool.close()
+    elapsed = time.monotonic() - started
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "chunks": len(latencies),
+        "rows_done": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else 0.0,
+        "p50_chunk_s": round(percentiles[49], 3) if percentiles else None,
+        "p99_chunk_s": round(percentiles[98], 3) if percentiles else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "chunk_errors": chunk_errors,
+        "chunk_error_rate": round(chunk_errors / (chunk_errors + len(latencies)), 3) if chunk_errors else 0.0,
+        "error": error,
+    }
+
+
+def run_config(csv_path: str, chunk_size: int, concurrency: int, options: dict[str, Any]) -> dict[str, Any]:
+    """Run one configuration; meant to be called in a fresh process so peak RSS is its own."""
+    # The pipeline prints every agent message; keep the report readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(_run_pipeline(csv_path, chunk_size, concurrency, options))
+
+
+def _config_key(result: dict[str, Any]) -> tuple[int, int, int]:
+    return result["rows"], result["chunk_size"], result["concurrency"]
+
+
+def compare(results: list[dict[str, Any]], baseline_path: str, tolerance: float) -> list[str]:
+    """Return a line for every configuration whose rows/s dropped by more than ``tolerance``."""
+    with open(baseline_path, encoding="utf-8") as handle:
+        baseline = {_config_key(result): result for result in json.load(handle)}
+    regressions = []
+    for result in results:
+        before = baseline.get(_config_key(result))
+        if not before or not before["rows_per_s"]:
+            continue
+        change = result["rows_per_s"] / before["rows_per_s"] - 1
+        if change < -tolerance:
+            rows, chunk_size, concurrency = _config_key(result)
+            regressions.append(
+                f"rows={rows} chunk_size={chunk_size} concurrency={concurrency}: "
+                f"{before['rows_per_s']} -> {result['rows_per_s']} rows/s ({change:+.0%})"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[100, 1_000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--rounds", type=int, default=1, help="agent rounds per chunk conversation")
+    parser.add_argument("--latency-ms", type=float, default=50, help="median fake model latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of model latency")
+    parser.add_argument("--web-latency-ms", type=float, default=200)
+    parser.add_argument("--completion-tokens", type=int, default=80)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--serializer", default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed rows/s drop against the baseline")
+    args = parser.parse_args()
+
+    options = {
+        "rounds": args.rounds,
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "web_latency_ms": args.web_latency_ms,
+        "completion_tokens": args.completion_tokens,
+        "error_rate": args.error_rate,
+        "serializer": args.serializer,
+        "seed": args.seed,
+    }
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    print(
+        f"{'rows':>9} {'chunk':>6} {'conc':>4} {'chunks':>6} {'errors':>6} {'rows/s':>10} "
+        f"{'p50 s':>7} {'p99 s':>7} {'RSS MB':>7}"
+    )
+    for rows in args.rows:
+        csv_path = os.path.join(args.data_dir, f"diary_{rows}_{args.seed}.csv")
+        if not os.path.exists(csv_path):
+            write_synthetic_diary(csv_path, rows, seed=args.seed)
+        for chunk_size, concurrency in product(args.chunk_sizes, args.concurrency):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(run_config, csv_path, chunk_size, concurrency, options).result()
+            result = {"rows": rows, "chunk_size": chunk_size, "concurrency": concurrency, **result}
+            results.append(result)
+            print(
+                f"{rows:>9} {chunk_size:>6} {concurrency:>4} {result['chunks']:>6} "
+                f"{result['chunk_errors']:>6} {result['rows_per_s']:>10} "
+                f"{result['p50_chunk_s']!s:>7} {result['p99_chunk_s']!s:>7} {result['peak_rss_mb']:>7}"
+                + (f"  failed: {result['error'].splitlines()[0]}" if result["error"] else "")
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
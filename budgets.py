@@ -0,0 +1,69 @@
+"""Turn, token and time limits for chunk conversations.
+
+A chunk team used to stop only when an agent wrote "exit", so some chunk
+conversations ran far longer than the analysis needed. Each team now gets
+its own termination condition built from a ``ChunkBudget``: a cap on
+messages, on prompt plus completion tokens and on wall-clock time, with
+"exit" still accepted as an early stop. A ``RunTokenBudget`` caps the
+tokens spent by the whole run; once it is used up no new chunks start.
+"""
+
+import os
+from dataclasses import dataclass
+
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.conditions import (
+    MaxMessageTermination,
+    TextMentionTermination,
+    TimeoutTermination,
+    TokenUsageTermination,
+)
+
+
+@dataclass
+class ChunkBudget:
+    """Limits for one chunk conversation; a limit of 0 disables it."""
+
+    max_messages: int = 20
+    max_tokens: int = 0
+    timeout_seconds: float = 0
+    stop_text: str = "exit"
+
+    def termination(self) -> TerminationCondition:
+        """Build a fresh termination condition; conditions are stateful, so teams must not share one."""
+        condition: TerminationCondition = TextMentionTermination(self.stop_text)
+        if self.max_messages:
+            condition |= MaxMessageTermination(self.max_messages)
+        if self.max_tokens:
+            condition |= TokenUsageTermination(max_total_token=self.max_tokens)
+        if self.timeout_seconds:
+            condition |= TimeoutTermination(self.timeout_seconds)
+        return condition
+
+
+def chunk_budget_from_env() -> ChunkBudget:
+    """Read ``CHUNK_MAX_MESSAGES``, ``CHUNK_MAX_TOKENS`` and ``CHUNK_TIMEOUT``."""
+    return ChunkBudget(
+        max_messages=int(os.getenv("CHUNK_MAX_MESSAGES", "20")),
+        max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", "0")),
+        timeout_seconds=float(os.getenv("CHUNK_TIMEOUT", "0")),
+    )
+
+
+class RunTokenBudget:
+    """Tokens spent by all chunks of a run, against an optional limit."""
+
+    def __init__(self, limit: int = 0) -> None:
+        self.limit = limit
+        self.spent = 0
+
+    def spend(self, tokens: int) -> None:
+        self.spent += tokens
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.limit) and self.spent >= self.limit
+
+
+def run_budget_from_env() -> RunTokenBudget:
+    return RunTokenBudget(int(os.getenv("RUN_MAX_TOKENS", "0")))
@@ -0,0 +1,159 @@
+"""Durable per-chunk conversation logs and resumable runs.
+
+Each chunk's messages are written as soon as the chunk finishes, and a
+small JSON manifest records which ``batch_start`` ranges are complete. The
+manifest is keyed by the input file hash and the chunking settings, so
+``--resume`` only skips chunks whose boundaries are guaranteed to be the
+same as in the interrupted run.
+
+Logs go to a Parquet dataset partitioned by run and batch, which can be
+queried without loading whole runs; a CSV copy is available on request.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+LOG_COLUMNS = [
+    "batch_start",
+    "batch_end",
+    "source",
+    "content",
+    "type",
+    "prompt_tokens",
+    "completion_tokens",
+]
+
+# ``source`` and ``type`` take a handful of values, so they are dictionary
+# encoded and read back as categoricals.
+LOG_SCHEMA = pa.schema(
+    [
+        ("batch_start", pa.int64()),
+        ("batch_end", pa.int64()),
+        ("source", pa.dictionary(pa.int32(), pa.string())),
+        ("content", pa.string()),
+        ("type", pa.dictionary(pa.int32(), pa.string())),
+        ("prompt_tokens", pa.int64()),
+        ("completion_tokens", pa.int64()),
+    ]
+)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while block := handle.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """Completed chunk ranges and the log size after the last of them."""
+
+    def __init__(self, path: str, key: dict[str, Any]) -> None:
+        self.path = path
+        self.key = key
+        self.completed: dict[int, int] = {}
+        self.log_offset = 0
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+
+    @classmethod
+    def open(cls, path: str, key: dict[str, Any], resume: bool) -> "RunManifest":
+        """Load the manifest at ``path`` when resuming a run with the same key.
+
+        Otherwise, or when the input or chunking settings changed, a fresh
+        manifest is returned and the previous progress is discarded.
+        """
+        manifest = cls(path, key)
+        if not resume or not os.path.exists(path):
+            return manifest
+        with open(path, encoding="utf-8") as handle:
+            saved = json.load(handle)
+        if saved.get("key") != key:
+            print(f"Manifest {path} was written for a different input or chunk size; starting over.")
+            return manifest
+        manifest.completed = {int(start): end for start, end in saved["completed"]}
+        manifest.log_offset = saved["log_offset"]
+        manifest.run_id = saved.get("run_id", manifest.run_id)
+        return manifest
+
+    def is_done(self, batch_start: int) -> bool:
+        return batch_start in self.completed
+
+    def mark_done(self, batch_start: int, batch_end: int, log_offset: int) -> None:
+        self.completed[batch_start] = batch_end
+        self.log_offset = log_offset
+        self._save()
+
+    def _save(self) -> None:
+        payload = {
+            "key": self.key,
+            "completed": sorted(self.completed.items()),
+            "log_offset": self.log_offset,
+            "run_id": self.run_id,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class ConversationLogWriter:
+    """Append chunk messages to a CSV log, flushing each chunk to disk."""
+
+    def __init__(self, path: str, resume_offset: int = 0) -> None:
+        self.path = path
+        # Rows written after the last completed chunk belong to a chunk that
+        # will run again, so cut them off.
+        with open(path, "ab") as handle:
+            handle.truncate(resume_offset)
+
+    def append(self, messages: list[dict[str, Any]], part: str = "part-0") -> int:
+        """Write ``messages`` and return the log size in bytes afterwards.
+
+        ``part`` only names files in the Parquet layout; every CSV row goes
+        to the one file.
+        """
+        if messages:
+            header = os.path.getsize(self.path) == 0
+            frame = pd.DataFrame(messages, columns=LOG_COLUMNS)
+            with open(self.path, "a", encoding="utf-8-sig", newline="") as handle:
+                frame.to_csv(handle, header=header, index=False)
+                handle.flush()
+                os.fsync(handle.fileno())
+        return os.path.getsize(self.path)
+
+
+class ParquetLogWriter:
+    """Write each chunk's messages to ``root/run=<run_id>/batch=<batch_start>/``.
+
+    A chunk that runs again after an interruption replaces its earlier,
+    partial file, so a resumed run never duplicates messages. Messages that
+    belong to a batch but not to its chunk conversation, such as a run's
+    synthesis, go to another ``part`` of the same partition.
+    """
+
+    def __init__(self, root: str, run_id: str, compression: str = "zstd") -> None:
+        self.root = root
+        self.run_id = run_id
+        self.compression = compression
+
+    def append(self, messages: list[dict[str, Any]], part: str = "part-0") -> None:
+        if not messages:
+            return
+        table = pa.Table.from_pylist([{col: msg[col] for col in LOG_COLUMNS} for msg in messages], schema=LOG_SCHEMA)
+        directory = os.path.join(self.root, f"run={self.run_id}", f"batch={messages[0]['batch_start']}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{part}.parquet")
+        # Dataset readers skip dot files, so a half-written file is never read.
+        tmp_path = os.path.join(directory, f".{part}.parquet.tmp")
+        pq.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
@@ -0,0 +1,61 @@
+"""Token-budget chunking of CSV rows.
+
+Row width varies a lot between files (and within the baby diary, because
+of the ``details`` JSON and free-text ``note`` columns), so a fixed row
+count either overflows the context window or wastes calls on tiny chunks.
+``split_by_tokens`` packs consecutive rows until the estimated prompt size
+reaches the budget of the target model.
+"""
+
+import os
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from tokens import estimate_row_tokens, estimate_tokens
+
+# Target prompt tokens per chunk. Names are matched by prefix so dated
+# variants such as "gemini-2.5-pro-exp-03-25" pick up their family budget.
+MODEL_TOKEN_BUDGETS = {
+    "gemini-1.5-flash-8b": 8000,
+    "gemini-1.5-flash": 12000,
+    "gemini-2.0-flash": 16000,
+    "gemini-2.5-flash": 16000,
+    "gemini-2.5-pro": 32000,
+}
+DEFAULT_TOKEN_BUDGET = 8000
+
+
+def token_budget_for(model_name: str) -> int:
+    """Return the chunk budget for ``model_name``; ``CHUNK_TOKEN_BUDGET`` overrides it."""
+    override = os.getenv("CHUNK_TOKEN_BUDGET")
+    if override:
+        return int(override)
+    matches = [prefix for prefix in MODEL_TOKEN_BUDGETS if model_name.startswith(prefix)]
+    if not matches:
+        return DEFAULT_TOKEN_BUDGET
+    return MODEL_TOKEN_BUDGETS[max(matches, key=len)]
+
+
+def split_by_tokens(df: pd.DataFrame, token_budget: int, max_rows: int | None = None) -> Iterator[pd.DataFrame]:
+    """Yield consecutive slices of ``df`` that fit ``token_budget``.
+
+    Every slice holds at least one row, so a single oversized row becomes
+    its own chunk rather than stalling the split. ``max_rows`` additionally
+    caps the rows per slice.
+    """
+    if df.empty:
+        return
+    header_tokens = estimate_tokens(",".join(map(str, df.columns)))
+    cumulative = np.cumsum(estimate_row_tokens(df).to_numpy())
+    total_rows = len(df)
+    start = 0
+    while start < total_rows:
+        base = cumulative[start - 1] if start else 0
+        end = int(np.searchsorted(cumulative, base + token_budget - header_tokens, side="right"))
+        end = max(end, start + 1)
+        if max_rows:
+            end = min(end, start + max_rows)
+        yield df.iloc[start:end]
+        start = end
@@ -5,28 +5,57 @@ multiple agents to collaborate on analysis, and persist the conversation log.
 It is intended as a workflow automation example for teaching.
 """
 
+import argparse
 import asyncio
 import os
-from typing import Any
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Container
 
 import pandas as pd
 from autogen_agentchat.agents import AssistantAgent, UserProxyAgent
-from autogen_agentchat.conditions import TextMentionTermination
-from autogen_agentchat.messages import TextMessage
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage, TextMessage
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_ext.agents.web_surfer import MultimodalWebSurfer
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from dotenv import load_dotenv
 
+from budgets import ChunkBudget, RunTokenBudget, chunk_budget_from_env, run_budget_from_env
+from checkpoint import ConversationLogWriter, ParquetLogWriter, RunManifest, file_hash
+from chunking import token_budget_for
+from digest import build_digest, sample_rows
+from ingest import count_records, stream_chunks
+from pool import ChunkTeam, TeamPool
+from scheduler import ChunkScheduler, ModelRateLimiter, ScheduledJob, rate_limiter_for
+from serializers import get_serializer
+from telemetry import telemetry, write_telemetry_from_env
+from tokens import estimate_tokens
+from webcache import CachedWebSurfer, WebCache, web_cache_from_env
+
 load_dotenv()
 
 
-def _build_prompt(chunk: pd.DataFrame, start_idx: int, total_records: int) -> str:
-    chunk_data = chunk.to_dict(orient="records")
+def _build_prompt(
+    chunk: pd.DataFrame,
+    start_idx: int,
+    total_records: int | None,
+    serializer: str = "csv",
+    digest_sample_rows: int | None = None,
+) -> str:
     end_idx = start_idx + len(chunk) - 1
+    total_label = total_records if total_records is not None else "an unknown total"
+    if digest_sample_rows is None:
+        batch_section = f"Batch data:\n{get_serializer(serializer)(chunk)}\n\n"
+    else:
+        sample = sample_rows(chunk, digest_sample_rows)
+        batch_section = (
+            f"Pre-computed statistics for the batch:\n{build_digest(chunk)}\n\n"
+            f"Sample rows ({len(sample)} of {len(chunk)}):\n{get_serializer(serializer)(sample)}\n\n"
+        )
     return (
-        f"You are analyzing records {start_idx} to {end_idx} out of {total_records}.\n"
-        f"Batch data:\n{chunk_data}\n\n"
+        f"You are analyzing records {start_idx} to {end_idx} out of {total_label}.\n"
+        f"{batch_section}"
         "Work together to do the following:\n"
         "1. Identify relevant patterns in the batch.\n"
         "2. Highlight practical insights supported by the data.\n"
@@ -35,31 +64,102 @@ def _build_prompt(chunk: pd.DataFrame, start_idx: int, total_records: int) -> st
     )
 
 
+def build_team(
+    model_client: OpenAIChatCompletionClient,
+    budget: ChunkBudget,
+    web_cache: WebCache | None = None,
+) -> ChunkTeam:
+    data_agent = AssistantAgent("data_agent", model_client)
+    if web_cache is not None:
+        web_surfer = CachedWebSurfer("web_surfer", model_client, web_cache)
+    else:
+        web_surfer = MultimodalWebSurfer("web_surfer", model_client)
+    assistant = AssistantAgent("assistant", model_client)
+    user_proxy = UserProxyAgent("user_proxy")
+
+    termination = budget.termination()
+    team = RoundRobinGroupChat(
+        [data_agent, web_surfer, assistant, user_proxy],
+        termination_condition=termination,
+    )
+    return ChunkTeam(team, web_surfer, termination)
+
+
+@asynccontextmanager
+async def _chunk_team(
+    model_client: OpenAIChatCompletionClient,
+    budget: ChunkBudget,
+    team_pool: TeamPool | None,
+) -> AsyncIterator[RoundRobinGroupChat]:
+    if team_pool is not None:
+        async with team_pool.acquire() as team:
+            yield team
+        return
+    chunk_team = build_team(model_client, budget)
+    try:
+        yield chunk_team.team
+    finally:
+        await chunk_team.close()
+
+
 async def process_chunk(
     chunk: pd.DataFrame,
     start_idx: int,
-    total_records: int,
+    total_records: int | None,
     model_client: OpenAIChatCompletionClient,
-    termination_condition: TextMentionTermination,
+    budget: ChunkBudget,
+    rate_limiter: ModelRateLimiter | None = None,
+    serializer: str = "csv",
+    digest_sample_rows: int | None = None,
+    prompt: str | None = None,
+    team_pool: TeamPool | None = None,
+    on_message: Callable[[dict[str, Any]], None] | None = None,
+    run_budget: RunTokenBudget | None = None,
 ) -> list[dict[str, Any]]:
-    prompt = _build_prompt(chunk, start_idx, total_records)
-
-    local_data_agent = AssistantAgent("data_agent", model_client)
-    local_web_surfer = MultimodalWebSurfer("web_surfer", model_client)
-    local_assistant = AssistantAgent("assistant", model_client)
-    local_user_proxy = UserProxyAgent("user_proxy")
+    """Run one chunk conversation and return its messages.
 
-    local_team = RoundRobinGroupChat(
-        [local_data_agent, local_web_surfer, local_assistant, local_user_proxy],
-        termination_condition=termination_condition,
-    )
+    ``on_message`` is called with each message as soon as it arrives, for
+    callers that stream the conversation instead of waiting for the chunk.
+    """
+    prompt = prompt or _build_prompt(chunk, start_idx, total_records, serializer, digest_sample_rows)
+    # The scheduler reserved one request and the estimated prompt tokens
+    # before starting this chunk; the first reported usage settles it.
+    reserved_tokens = estimate_tokens(prompt)
+    print(f"[{start_idx}-{start_idx + len(chunk) - 1}] prompt ~{reserved_tokens} tokens ({serializer})")
 
+    model = model_client.model_info.get("family", "unknown")
     messages: list[dict[str, Any]] = []
-    async for event in local_team.run_stream(task=prompt):
-        if isinstance(event, TextMessage):
-            print(f"[{event.source}] => {event.content}\n")
-            messages.append(
-                {
+    started = last_turn = time.monotonic()
+    first_reply = True
+    async with _chunk_team(model_client, budget, team_pool) as team:
+        async for event in team.run_stream(task=prompt):
+            if isinstance(event, TaskResult):
+                print(f"[{start_idx}-{start_idx + len(chunk) - 1}] stopped: {event.stop_reason}")
+            # The first chat message is the task itself; every later one
+            # closes a turn of the agent that sent it.
+            if isinstance(event, BaseChatMessage) and event.source != "user":
+                now = time.monotonic()
+                if first_reply:
+                    telemetry.observe("chunk_first_message_seconds", now - started, model=model)
+                    first_reply = False
+                telemetry.observe("agent_turn_seconds", now - last_turn, agent=event.source)
+                telemetry.count("agent_messages_total", agent=event.source)
+                if event.models_usage:
+                    usage = event.models_usage
+                    telemetry.count("agent_prompt_tokens_total", usage.prompt_tokens, agent=event.source, model=model)
+                    telemetry.count(
+                        "agent_completion_tokens_total", usage.completion_tokens, agent=event.source, model=model
+                    )
+                last_turn = now
+            if isinstance(event, TextMessage):
+                print(f"[{event.source}] => {event.content}\n")
+                if run_budget and event.models_usage:
+                    run_budget.spend(event.models_usage.prompt_tokens + event.models_usage.completion_tokens)
+                if rate_limiter and event.models_usage:
+                    used_tokens = event.models_usage.prompt_tokens + event.models_usage.completion_tokens
+                    rate_limiter.consume(used_tokens - reserved_tokens, requests=0 if reserved_tokens else 1)
+                    reserved_tokens = 0
+                message = {
                     "batch_start": start_idx,
                     "batch_end": start_idx + len(chunk) - 1,
                     "source": event.source,
@@ -68,15 +168,80 @@ async def process_chunk(
                     "prompt_tokens": event.models_usage.prompt_tokens if event.models_usage else None,
                     "completion_tokens": event.models_usage.completion_tokens if event.models_usage else None,
                 }
-            )
+                messages.append(message)
+                if on_message:
+                    on_message(message)
+    telemetry.observe("chunk_seconds", time.monotonic() - started, model=model)
+    telemetry.count("chunks_total", model=model)
+    telemetry.count("rows_total", len(chunk), model=model)
     return messages
 
 
-async def main() -> None:
+async def chunk_jobs(
+    csv_file_path: str,
+    chunk_size: int,
+    total_records: int | None,
+    model_client: OpenAIChatCompletionClient,
+    budget: ChunkBudget,
+    rate_limiter: ModelRateLimiter,
+    queue_depth: int = 2,
+    serializer: str = "csv",
+    token_budget: int | None = None,
+    digest_sample_rows: int | None = None,
+    completed: Container[int] = (),
+    team_pool: TeamPool | None = None,
+    on_message: Callable[[dict[str, Any]], None] | None = None,
+    run_budget: RunTokenBudget | None = None,
+) -> AsyncIterator[ScheduledJob]:
+    """Read ``csv_file_path`` lazily and wrap each chunk as a scheduler job.
+
+    Chunks whose ``batch_start`` is in ``completed`` are skipped. Each job's
+    context is its ``(batch_start, batch_end)`` range.
+    """
+    idx = 0
+    async for start_idx, chunk in stream_chunks(csv_file_path, chunk_size, queue_depth, token_budget):
+        if start_idx in completed:
+            idx += 1
+            continue
+        prompt = _build_prompt(chunk, start_idx, total_records, serializer, digest_sample_rows)
+        yield ScheduledJob(
+            index=idx,
+            estimated_tokens=estimate_tokens(prompt),
+            context=(start_idx, start_idx + len(chunk) - 1),
+            factory=lambda chunk=chunk, start_idx=start_idx, prompt=prompt: process_chunk(
+                chunk,
+                start_idx,
+                total_records,
+                model_client,
+                budget,
+                rate_limiter=rate_limiter,
+                serializer=serializer,
+                prompt=prompt,
+                team_pool=team_pool,
+                on_message=on_message,
+                run_budget=run_budget,
+            ),
+        )
+        idx += 1
+
+
+async def main(resume: bool = False) -> None:
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
     csv_file_path = os.getenv("CSV_FILE_PATH", "cuboai_baby_diary.csv")
     chunk_size = int(os.getenv("CSV_CHUNK_SIZE", "1000"))
+    max_concurrency = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+    requests_per_minute = int(os.getenv("MODEL_RPM", "0"))
+    tokens_per_minute = int(os.getenv("MODEL_TPM", "0"))
+    queue_depth = int(os.getenv("CSV_QUEUE_DEPTH", "2"))
+    count_rows = os.getenv("CSV_COUNT_RECORDS", "1") != "0"
+    serializer = os.getenv("CHUNK_SERIALIZER", "csv")
+    # In digest mode chunks are summarized locally, so they are split by
+    # row count only; the raw rows no longer reach the prompt.
+    pre_aggregate = os.getenv("PRE_AGGREGATE", "0") == "1"
+    digest_sample_rows = int(os.getenv("DIGEST_SAMPLE_ROWS", "20")) if pre_aggregate else None
+    log_dir = os.getenv("LOG_DIR", "conversation_logs")
+    csv_log = os.getenv("LOG_CSV", "0") == "1"
 
     if not gemini_api_key:
         raise RuntimeError("GEMINI_API_KEY is not set. Please update your .env file.")
@@ -89,29 +254,79 @@ async def main() -> None:
         api_key=gemini_api_key,
     )
 
-    termination_condition = TextMentionTermination("exit")
-    chunks = list(pd.read_csv(csv_file_path, chunksize=chunk_size))
-    total_records = sum(chunk.shape[0] for chunk in chunks)
-
-    tasks = [
-        process_chunk(
-            chunk,
-            idx * chunk_size,
-            total_records,
-            model_client,
-            termination_condition,
-        )
-        for idx, chunk in enumerate(chunks)
-    ]
+    budget = chunk_budget_from_env()
+    run_budget = run_budget_from_env()
+    total_records = count_records(csv_file_path) if count_rows else None
 
-    results = await asyncio.gather(*tasks)
-    all_messages = [msg for batch in results for msg in batch]
+    rate_limiter = rate_limiter_for(model_name, requests_per_minute, tokens_per_minute)
+    scheduler = ChunkScheduler(
+        rate_limiter,
+        max_concurrency=max_concurrency,
+        stop_when=lambda: run_budget.exhausted,
+    )
 
-    df_log = pd.DataFrame(all_messages)
+    token_budget = None if pre_aggregate else token_budget_for(model_name)
     output_file = "all_conversation_log.csv"
-    df_log.to_csv(output_file, index=False, encoding="utf-8-sig")
-    print(f"Saved conversation log to {output_file}")
+    os.makedirs(log_dir, exist_ok=True)
+    manifest = RunManifest.open(
+        os.path.join(log_dir, "_manifest.json"),
+        key={
+            "file_hash": file_hash(csv_file_path),
+            "chunk_size": chunk_size,
+            "token_budget": token_budget,
+            "digest_sample_rows": digest_sample_rows,
+            "csv_log": csv_log,
+        },
+        resume=resume,
+    )
+    if manifest.completed:
+        print(f"Resuming: {len(manifest.completed)} chunks already done.")
+    log_writer = ParquetLogWriter(log_dir, manifest.run_id)
+    csv_writer = ConversationLogWriter(output_file, resume_offset=manifest.log_offset) if csv_log else None
+    web_cache = web_cache_from_env()
+    team_pool = TeamPool(lambda: build_team(model_client, budget, web_cache), size=max_concurrency)
+
+    jobs = chunk_jobs(
+        csv_file_path,
+        chunk_size,
+        total_records,
+        model_client,
+        budget,
+        rate_limiter,
+        queue_depth=queue_depth,
+        serializer=serializer,
+        token_budget=token_budget,
+        digest_sample_rows=digest_sample_rows,
+        completed=manifest.completed,
+        team_pool=team_pool,
+        run_budget=run_budget,
+    )
+    try:
+        await team_pool.warm()
+        async for job, messages in scheduler.stream(jobs):
+            telemetry.observe("chunk_queue_wait_seconds", job.queue_wait)
+            batch_start, batch_end = job.context
+            log_writer.append(messages)
+            log_offset = csv_writer.append(messages) if csv_writer else 0
+            manifest.mark_done(batch_start, batch_end, log_offset)
+    finally:
+        await team_pool.close()
+        web_cache.save()
+        print(f"Web cache: {web_cache.hits} hits, {web_cache.misses} misses")
+        print(f"Tokens used by chunk conversations: {run_budget.spent}")
+        write_telemetry_from_env()
+
+    print(f"Saved conversation log to {log_dir}/run={manifest.run_id}")
+    if csv_writer:
+        print(f"Saved CSV copy to {output_file}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip chunks already completed by a previous run on the same file",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(resume=args.resume))
@@ -0,0 +1,198 @@
+"""Local statistical digests of CSV chunks.
+
+Most of what the chunk agents are asked to find in the baby diary (event
+counts per profile, sleep durations, feeding volumes) can be computed
+locally with vectorized pandas operations. In digest mode the prompt
+carries these small tables plus a handful of raw sample rows instead of
+the whole chunk, which cuts prompt size by roughly an order of magnitude.
+Chunks without the diary columns get a generic per-column summary.
+"""
+
+import json
+
+import pandas as pd
+
+DIARY_COLUMNS = {"profile_id", "event_type", "start_time", "end_time", "details"}
+
+
+def parse_details(details: pd.Series) -> pd.DataFrame:
+    """Flatten the ``details`` JSON column into one column per nested key.
+
+    All non-empty values are parsed in a single ``json.loads`` call on a
+    JSON array, then flattened with ``pd.json_normalize`` (nested keys
+    become ``left.volume`` and so on). Rows are aligned with ``details``.
+    """
+    present = details.dropna()
+    present = present[present.astype(str).str.strip() != ""]
+    if present.empty:
+        return pd.DataFrame(index=details.index)
+    try:
+        records = json.loads("[" + ",".join(present.astype(str)) + "]")
+    except json.JSONDecodeError:
+        records = [_loads_or_empty(value) for value in present.astype(str)]
+    flat = pd.json_normalize(records, sep=".")
+    flat.index = present.index
+    return flat.reindex(details.index)
+
+
+def _loads_or_empty(value: str) -> dict:
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def iso_duration_minutes(values: pd.Series) -> pd.Series:
+    """Convert ISO 8601 durations such as ``P0Y0M0DT6H29M20S`` to minutes."""
+    parts = values.astype("string").str.extract(
+        r"(?:(?P<days>\d+)D)?T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>[\d.]+)S)?"
+    )
+    parts = parts.apply(pd.to_numeric, errors="coerce")
+    minutes = (
+        parts["days"].fillna(0) * 1440
+        + parts["hours"].fillna(0) * 60
+        + parts["minutes"].fillna(0)
+        + parts["seconds"].fillna(0) / 60
+    )
+    return minutes.where(parts.notna().any(axis=1))
+
+
+def _column(frame: pd.DataFrame, name: str) -> pd.Series:
+    if name in frame.columns:
+        return frame[name]
+    return pd.Series(float("nan"), index=frame.index)
+
+
+def _table(title: str, frame: pd.DataFrame | pd.Series) -> str:
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    if frame.empty:
+        return ""
+    return f"{title}:\n{frame.round(1).to_csv().strip()}"
+
+
+def _timestamps(values: pd.Series) -> pd.Series:
+    # ``loaders`` parses the diary timestamps while reading; only chunks
+    # from an untyped fallback read still hold strings.
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, errors="coerce")
+
+
+def diary_digest(chunk: pd.DataFrame) -> str:
+    start = _timestamps(chunk["start_time"])
+    end = _timestamps(chunk["end_time"])
+    details = parse_details(chunk["details"])
+    event_type = chunk["event_type"]
+    profile = chunk["profile_id"]
+
+    sections = [
+        f"Records: {len(chunk)}; profiles: {profile.nunique()}; "
+        f"time range: {start.min()} to {end.max()}",
+        _table("Events per profile", pd.crosstab(profile, event_type)),
+    ]
+
+    minutes = iso_duration_minutes(_column(details, "duration"))
+    minutes = minutes.fillna((end - start).dt.total_seconds() / 60)
+    is_sleep = event_type == "sleep"
+    sections.append(
+        _table(
+            "Sleep minutes per profile",
+            minutes[is_sleep].groupby(profile[is_sleep]).agg(["count", "sum", "mean", "median", "max"]),
+        )
+    )
+
+    is_bottle = event_type == "bottle"
+    volume = pd.to_numeric(_column(details, "volume"), errors="coerce")
+    bottle = pd.DataFrame(
+        {
+            "profile_id": profile[is_bottle],
+            "type": _column(details, "type")[is_bottle],
+            "unit": _column(details, "user_unit_preference")[is_bottle],
+            "volume": volume[is_bottle],
+        }
+    )
+    sections.append(
+        _table(
+            "Bottle volume per profile",
+            bottle.groupby(["profile_id", "type", "unit"], dropna=False)["volume"].agg(["count", "sum", "mean"]),
+        )
+    )
+
+    is_nursing = event_type == "nursing"
+    left_minutes = iso_duration_minutes(_column(details, "left.duration")).fillna(0)
+    right_minutes = iso_duration_minutes(_column(details, "right.duration")).fillna(0)
+    nursing_minutes = left_minutes + right_minutes
+    sections.append(
+        _table(
+            "Nursing minutes per profile",
+            nursing_minutes[is_nursing].groupby(profile[is_nursing]).agg(["count", "sum", "mean"]),
+        )
+    )
+
+    is_pumping = event_type == "pumping"
+    left_volume = pd.to_numeric(_column(details, "left.volume"), errors="coerce").fillna(0)
+    right_volume = pd.to_numeric(_column(details, "right.volume"), errors="coerce").fillna(0)
+    pumped = left_volume + right_volume
+    sections.append(
+        _table(
+            "Pumped volume per profile",
+            pumped[is_pumping].groupby(profile[is_pumping]).agg(["count", "sum", "mean"]),
+        )
+    )
+
+    is_diaper = event_type == "diaper"
+    sections.append(
+        _table(
+            "Diaper types per profile",
+            pd.crosstab(profile[is_diaper], _column(details, "type")[is_diaper]),
+        )
+    )
+
+    is_solids = event_type == "solids"
+    sections.append(
+        _table(
+            "Solids reactions per profile",
+            pd.crosstab(profile[is_solids], _column(details, "reaction")[is_solids]),
+        )
+    )
+    if is_solids.any():
+        allergies = int(_column(details, "allergy")[is_solids].eq(True).sum())
+        sections.append(f"Solids meals with allergy flagged: {allergies}")
+
+    if "note" in chunk.columns:
+        sections.append(f"Rows with notes: {int(chunk['note'].notna().sum())}")
+
+    return "\n\n".join(section for section in sections if section)
+
+
+def generic_digest(chunk: pd.DataFrame) -> str:
+    sections = [f"Records: {len(chunk)}"]
+    numeric = chunk.select_dtypes("number")
+    if not numeric.empty:
+        sections.append(_table("Numeric columns", numeric.describe().T))
+    for col in chunk.columns.difference(numeric.columns):
+        counts = chunk[col].value_counts()
+        if 0 < len(counts) <= 20:
+            sections.append(_table(f"Values of {col}", counts))
+        elif len(counts):
+            sections.append(f"{col}: {len(counts)} distinct values")
+    return "\n\n".join(section for section in sections if section)
+
+
+def build_digest(chunk: pd.DataFrame) -> str:
+    if DIARY_COLUMNS.issubset(chunk.columns):
+        return diary_digest(chunk)
+    return generic_digest(chunk)
+
+
+def sample_rows(chunk: pd.DataFrame, max_rows: int) -> pd.DataFrame:
+    """Pick up to ``max_rows`` rows, spread across event types when present."""
+    if len(chunk) <= max_rows:
+        return chunk
+    if "event_type" in chunk.columns:
+        per_type = max(1, max_rows // max(chunk["event_type"].nunique(), 1))
+        sample = chunk.groupby("event_type", sort=False).head(per_type)
+        return sample.head(max_rows).sort_index()
+    return chunk.sample(max_rows, random_state=0).sort_index()
@@ -0,0 +1,90 @@
+"""Lazy CSV ingestion for the chunk analysis pipeline.
+
+Chunks are read on a worker thread and handed to the agent workers
+through a bounded queue, so only a few chunks are held in memory at a
+time and the first chunk can be analysed while the rest of the file is
+still on disk.
+"""
+
+import asyncio
+from typing import AsyncIterator
+
+import pandas as pd
+
+from chunking import split_by_tokens
+from loaders import read_csv_options
+
+_READ_BLOCK_SIZE = 1 << 20
+
+
+def count_records(csv_file_path: str) -> int:
+    """Estimate the number of data rows by counting line breaks.
+
+    This is a single binary pass over the file. Quoted fields that contain
+    line breaks are counted more than once, so treat the result as an
+    upper bound rather than an exact row count.
+    """
+    lines = 0
+    last_block = b""
+    with open(csv_file_path, "rb") as handle:
+        while block := handle.read(_READ_BLOCK_SIZE):
+            lines += block.count(b"\n")
+            last_block = block
+    if last_block and not last_block.endswith(b"\n"):
+        lines += 1
+    return max(lines - 1, 0)
+
+
+async def stream_chunks(
+    csv_file_path: str,
+    chunk_size: int,
+    queue_depth: int = 2,
+    token_budget: int | None = None,
+) -> AsyncIterator[tuple[int, pd.DataFrame]]:
+    """Yield ``(start_idx, chunk)`` pairs read lazily from ``csv_file_path``.
+
+    A producer task keeps at most ``queue_depth`` chunks buffered ahead of
+    the consumer and blocks while the queue is full. With ``token_budget``
+    the rows are repacked so each chunk fits the budget, and ``chunk_size``
+    becomes the maximum number of rows per chunk.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_depth))
+    done = object()
+
+    async def produce() -> None:
+        try:
+            options = read_csv_options(csv_file_path)
+            with pd.read_csv(csv_file_path, chunksize=chunk_size, **options) as reader:
+                start_idx = 0
+                carry = None
+                while (block := await asyncio.to_thread(next, reader, None)) is not None:
+                    if token_budget is None:
+                        pieces = [block]
+                    else:
+                        # The last slice may still have room for rows from
+                        # the next block, so hold it back until then.
+                        if carry is not None:
+                            categories = block.select_dtypes("category").columns
+                            # Blocks have their own categories, so concat
+                            # falls back to object unless they are re-cast.
+                            block = pd.concat([carry, block]).astype({col: "category" for col in categories})
+                        pieces = list(split_by_tokens(block, token_budget, chunk_size))
+                        carry = pieces.pop()
+                    for chunk in pieces:
+                        await queue.put((start_idx, chunk))
+                        start_idx += len(chunk)
+                if carry is not None:
+                    await queue.put((start_idx, carry))
+        except Exception as exc:
+            await queue.put(exc)
+        else:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
@@ -0,0 +1,191 @@
+"""Analysis jobs shared by all sessions of the web UI.
+
+Uploads are turned into jobs on one queue served by a fixed number of
+workers, so many analysts can use one server without each upload running
+inline in its request handler. Every job writes its own log as each chunk
+finishes, and an upload identical to a queued, running or finished job
+(same content hash and chunk size) follows that job instead of starting
+another run.
+"""
+
+import asyncio
+import glob
+import os
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable
+
+from checkpoint import ConversationLogWriter, ParquetLogWriter, file_hash
+from telemetry import telemetry
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class AnalysisJob:
+    id: str
+    file_path: str
+    chunk_size: int
+    log_path: str
+    status: str = QUEUED
+    error: str | None = None
+    updates: list[str] = field(default_factory=list)
+    submitted_at: float = field(default_factory=time.monotonic)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    @property
+    def log_files(self) -> list[str]:
+        """The CSV log, or the Parquet files of the job's dataset written so far."""
+        if os.path.isdir(self.log_path):
+            return sorted(glob.glob(os.path.join(self.log_path, "**", "*.parquet"), recursive=True))
+        return [self.log_path] if os.path.exists(self.log_path) else []
+
+    def _notify(self) -> None:
+        # Wake everyone waiting on the current event and give later
+        # waiters a fresh one.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class JobQueue:
+    def __init__(
+        self,
+        run: Callable[[str, int, ParquetLogWriter | ConversationLogWriter], AsyncIterator[str]],
+        max_workers: int = 2,
+        output_dir: str = "runs",
+        keep_finished: int = 32,
+        csv_log: bool = False,
+    ) -> None:
+        self._run = run
+        self.max_workers = max(1, max_workers)
+        self.output_dir = output_dir
+        self.keep_finished = keep_finished
+        self.csv_log = csv_log
+        self._jobs: OrderedDict[str, AnalysisJob] = OrderedDict()
+        self._waiting: list[AnalysisJob] = []
+        self._queue: asyncio.Queue[AnalysisJob] | None = None
+        self._workers: list[asyncio.Task] = []
+
+    async def submit(self, file_path: str, chunk_size: int) -> tuple[AnalysisJob, bool]:
+        """Queue ``file_path`` for analysis.
+
+        Returns the job and whether it was newly created; an identical
+        upload that is queued, running or done returns the existing job.
+        """
+        # Hashing a large upload would block every other session's updates.
+        digest = await asyncio.to_thread(file_hash, file_path)
+        job_id = f"{digest[:16]}-{chunk_size}"
+        existing = self._jobs.get(job_id)
+        if existing is not None and existing.status != FAILED:
+            return existing, False
+
+        job = AnalysisJob(
+            id=job_id,
+            file_path=file_path,
+            chunk_size=chunk_size,
+            # Parquet logs share dataAgent's layout: one ``run=<job id>``
+            # partition per job, one ``batch=<first record>`` per chunk.
+            log_path=(
+                os.path.join(self.output_dir, job_id, "conversation_log.csv")
+                if self.csv_log
+                else os.path.join(self.output_dir, f"run={job_id}")
+            ),
+        )
+        self._jobs[job_id] = job
+        self._start_workers()
+        self._waiting.append(job)
+        self._queue.put_nowait(job)
+        self._forget_old_jobs()
+        return job, True
+
+    def get(self, job_id: str) -> AnalysisJob | None:
+        return self._jobs.get(job_id)
+
+    def page(self, job: AnalysisJob, page: int, page_size: int) -> tuple[list[str], int]:
+        """Return the updates on 0-based ``page`` of ``job`` and the number of pages."""
+        page_count = max(1, -(-len(job.updates) // page_size))
+        start = page * page_size
+        return job.updates[start : start + page_size], page_count
+
+    def position(self, job: AnalysisJob) -> int:
+        """1-based place of ``job`` in the queue, or 0 once it has started."""
+        if job not in self._waiting:
+            return 0
+        return self._waiting.index(job) + 1
+
+    async def positions(self, job: AnalysisJob) -> AsyncIterator[int]:
+        """Yield the queue position of ``job`` each time it changes, until it starts."""
+        last = None
+        while job.status == QUEUED:
+            changed = job._changed
+            position = self.position(job)
+            if position != last:
+                last = position
+                yield position
+            # Positions move when any job starts, so poll as well.
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def follow(self, job: AnalysisJob, start: int = 0) -> AsyncIterator[str]:
+        """Yield the updates of ``job`` from index ``start`` until it finishes."""
+        index = start
+        while True:
+            changed = job._changed
+            while index < len(job.updates):
+                yield job.updates[index]
+                index += 1
+            if job.finished:
+                return
+            await changed.wait()
+
+    def _start_workers(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._waiting.remove(job)
+            telemetry.observe("ui_job_queue_wait_seconds", time.monotonic() - job.submitted_at)
+            job.status = RUNNING
+            job._notify()
+            try:
+                async for update in self._run(job.file_path, job.chunk_size, self._log_writer(job)):
+                    job.updates.append(update)
+                    job._notify()
+                job.status = DONE
+            except Exception as exc:
+                job.error = str(exc)
+                job.status = FAILED
+                telemetry.count("ui_jobs_failed_total")
+            finally:
+                telemetry.observe("ui_job_seconds", time.monotonic() - job.submitted_at)
+                job._notify()
+                self._queue.task_done()
+
+    def _log_writer(self, job: AnalysisJob) -> ParquetLogWriter | ConversationLogWriter:
+        # A job submitted again after failing starts a fresh log.
+        if self.csv_log:
+            os.makedirs(os.path.dirname(job.log_path), exist_ok=True)
+            return ConversationLogWriter(job.log_path)
+        shutil.rmtree(job.log_path, ignore_errors=True)
+        return ParquetLogWriter(self.output_dir, job.id)
+
+    def _forget_old_jobs(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
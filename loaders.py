@@ -0,0 +1,69 @@
+"""Typed CSV loading for the datasets the agents analyse.
+
+With default settings ``pd.read_csv`` reads every text column as a Python
+object and leaves timestamps as strings that later code parses again.
+Known datasets are recognised by their header and read with a schema:
+repeated labels such as ``event_type`` become categoricals, free text
+becomes the string dtype, timestamps are parsed once while reading, and
+columns nothing downstream uses are not read at all. The options are
+passed to the chunked reader in ``ingest``, which keeps the pandas C
+engine because it is the only one that supports ``chunksize``.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class CsvSchema:
+    name: str
+    # A file is read with this schema when its header has all of these.
+    required: frozenset[str]
+    dtypes: dict[str, str] = field(default_factory=dict)
+    timestamps: tuple[str, ...] = ()
+    drop: tuple[str, ...] = ()
+
+
+BABY_DIARY = CsvSchema(
+    name="baby_diary",
+    required=frozenset({"profile_id", "event_type", "start_time", "end_time", "details"}),
+    dtypes={
+        "gender": "category",
+        "event_type": "category",
+        "note": "string",
+        "details": "string",
+    },
+    timestamps=("start_time", "end_time", "created_at", "birthdate", "預產期"),
+    # Device ids are opaque and must not reach the prompts.
+    drop=("encrypted_device_id",),
+)
+
+SCHEMAS = [BABY_DIARY]
+
+
+def read_header(path: str) -> list[str]:
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def schema_for(columns: list[str]) -> CsvSchema | None:
+    for schema in SCHEMAS:
+        if schema.required.issubset(columns):
+            return schema
+    return None
+
+
+def read_csv_options(path: str) -> dict[str, Any]:
+    """``pd.read_csv`` keyword arguments for ``path`` from its matching schema."""
+    columns = read_header(path)
+    schema = schema_for(columns)
+    if schema is None:
+        return {}
+    usecols = [col for col in columns if col not in schema.drop]
+    return {
+        "usecols": usecols,
+        "dtype": {col: dtype for col, dtype in schema.dtypes.items() if col in usecols},
+        "parse_dates": [col for col in schema.timestamps if col in usecols],
+    }
+
@@ -8,19 +8,44 @@ import asyncio
 import os
 from typing import AsyncGenerator
 
-import pandas as pd
-from autogen_agentchat.conditions import TextMentionTermination
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from dotenv import load_dotenv
 
-from dataAgent import process_chunk
+from budgets import chunk_budget_from_env, run_budget_from_env
+from checkpoint import ConversationLogWriter, ParquetLogWriter
+from chunking import token_budget_for
+from dataAgent import build_team, chunk_jobs
+from ingest import count_records
+from pool import TeamPool
+from scheduler import ChunkScheduler, rate_limiter_for
+from synthesis import TreeReducer, chunk_conclusion, model_reducer
+from telemetry import telemetry, write_telemetry_from_env
+from webcache import web_cache_from_env
 
 load_dotenv()
 
 
-async def run_analysis(csv_file_path: str, chunk_size: int = 100) -> AsyncGenerator[str, None]:
+async def run_analysis(
+    csv_file_path: str,
+    chunk_size: int = 100,
+    log_writer: ParquetLogWriter | ConversationLogWriter | None = None,
+) -> AsyncGenerator[str, None]:
+    """Yield each message of the run as it arrives, then the synthesis.
+
+    With ``log_writer``, each chunk's messages are written as soon as the
+    chunk finishes and the synthesis is written last, as in ``dataAgent``.
+    """
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b")
+    max_concurrency = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+    requests_per_minute = int(os.getenv("MODEL_RPM", "0"))
+    tokens_per_minute = int(os.getenv("MODEL_TPM", "0"))
+    queue_depth = int(os.getenv("CSV_QUEUE_DEPTH", "2"))
+    count_rows = os.getenv("CSV_COUNT_RECORDS", "1") != "0"
+    serializer = os.getenv("CHUNK_SERIALIZER", "csv")
+    pre_aggregate = os.getenv("PRE_AGGREGATE", "0") == "1"
+    digest_sample_rows = int(os.getenv("DIGEST_SAMPLE_ROWS", "20")) if pre_aggregate else None
+    synthesis_fan_in = int(os.getenv("SYNTHESIS_FAN_IN", "4"))
 
     if not gemini_api_key:
         raise RuntimeError("GEMINI_API_KEY is not set. Please update your .env file.")
@@ -32,27 +57,104 @@ async def run_analysis(csv_file_path: str, chunk_size: int = 100) -> AsyncGenera
         model=model_name,
         api_key=gemini_api_key,
     )
-    termination_condition = TextMentionTermination("exit")
-
-    chunks = list(pd.read_csv(csv_file_path, chunksize=chunk_size))
-    total_records = sum(chunk.shape[0] for chunk in chunks)
-
-    tasks = [
-        process_chunk(
-            chunk=chunk,
-            start_idx=idx * chunk_size,
-            total_records=total_records,
-            model_client=model_client,
-            termination_condition=termination_condition,
-        )
-        for idx, chunk in enumerate(chunks)
-    ]
-
-    for coro in asyncio.as_completed(tasks):
-        chunk_messages = await coro
-        for msg in chunk_messages:
-            batch_range = f"{msg['batch_start']}-{msg['batch_end']}"
-            yield f"[{batch_range}][{msg['source']}] {msg['content']}"
+    budget = chunk_budget_from_env()
+    run_budget = run_budget_from_env()
+
+    # The line count reads the whole upload, so it runs off the event loop
+    # the UI sessions share.
+    total_records = await asyncio.to_thread(count_records, csv_file_path) if count_rows else None
+    rate_limiter = rate_limiter_for(model_name, requests_per_minute, tokens_per_minute)
+    scheduler = ChunkScheduler(
+        rate_limiter,
+        max_concurrency=max_concurrency,
+        stop_when=lambda: run_budget.exhausted,
+    )
+    web_cache = web_cache_from_env()
+    team_pool = TeamPool(lambda: build_team(model_client, budget, web_cache), size=max_concurrency)
+
+    # Every message of every chunk team lands on this queue as soon as it
+    # is produced, followed by a (job, messages) pair when its chunk ends.
+    updates: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    jobs = chunk_jobs(
+        csv_file_path,
+        chunk_size,
+        total_records,
+        model_client,
+        budget,
+        rate_limiter,
+        queue_depth=queue_depth,
+        serializer=serializer,
+        token_budget=None if pre_aggregate else token_budget_for(model_name),
+        digest_sample_rows=digest_sample_rows,
+        team_pool=team_pool,
+        on_message=updates.put_nowait,
+        run_budget=run_budget,
+    )
+
+    async def run_chunks() -> None:
+        try:
+            await team_pool.warm()
+            async for job, chunk_messages in scheduler.stream(jobs):
+                telemetry.observe("chunk_queue_wait_seconds", job.queue_wait)
+                updates.put_nowait((job, chunk_messages))
+        except Exception as exc:
+            updates.put_nowait(exc)
+        else:
+            updates.put_nowait(done)
+
+    # Chunk conclusions are merged in the background while later chunks
+    # are still being analysed; SYNTHESIS_FAN_IN=0 turns this off.
+    reducer = TreeReducer(model_reducer(model_client, rate_limiter), synthesis_fan_in) if synthesis_fan_in else None
+    finished: set[int] = set()
+    runner = asyncio.create_task(run_chunks())
+    try:
+        while (update := await updates.get()) is not done:
+            if isinstance(update, Exception):
+                raise update
+            if isinstance(update, dict):
+                batch_range = f"{update['batch_start']}-{update['batch_end']}"
+                yield f"[{batch_range}][{update['source']}] {update['content']}"
+                continue
+            job, chunk_messages = update
+            finished.add(job.index)
+            if log_writer:
+                log_writer.append(chunk_messages)
+            if reducer:
+                reducer.add(job.index, chunk_conclusion(chunk_messages))
+
+        if reducer:
+            # When the run budget is spent the scheduler drops queued jobs,
+            # which may sit between started ones; each gets an empty leaf so
+            # the leaf indices stay contiguous.
+            leaf_count = max(finished) + 1 if finished else 0
+            for index in range(leaf_count):
+                if index not in finished:
+                    reducer.add(index, None)
+            reducer.finish(leaf_count)
+            synthesis = await reducer.result()
+            if synthesis:
+                if log_writer:
+                    message = {
+                        "batch_start": synthesis.batch_start,
+                        "batch_end": synthesis.batch_end,
+                        "source": "synthesis",
+                        "content": synthesis.text,
+                        "type": "TextMessage",
+                        "prompt_tokens": None,
+                        "completion_tokens": None,
+                    }
+                    log_writer.append([message], part="synthesis")
+                yield f"[{synthesis.batch_start}-{synthesis.batch_end}][synthesis] {synthesis.text}"
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        if reducer:
+            reducer.cancel()
+        await team_pool.close()
+        web_cache.save()
+        write_telemetry_from_env()
 
 
 async def collect_analysis(csv_file_path: str, chunk_size: int = 100) -> str:
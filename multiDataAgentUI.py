@@ -4,68 +4,126 @@ This demo is useful for discussing lightweight deployment patterns in an
 agentic AI course.
 """
 
-import asyncio
 import os
+from collections import deque
 from pathlib import Path
 
 import gradio as gr
-import pandas as pd
 from dotenv import load_dotenv
 
+from jobs import FAILED, JobQueue
 from multiDataAgent import run_analysis
+from telemetry import telemetry
 
 load_dotenv()
 
-conversation_log: list[dict[str, str]] = []
+job_queue = JobQueue(
+    run_analysis,
+    max_workers=int(os.getenv("UI_MAX_JOBS", "2")),
+    output_dir=os.getenv("UI_OUTPUT_DIR", "runs"),
+    csv_log=os.getenv("LOG_CSV", "0") == "1",
+)
+VISIBLE_MESSAGES = int(os.getenv("UI_VISIBLE_MESSAGES", "50"))
+LOG_PAGE_SIZE = int(os.getenv("UI_LOG_PAGE_SIZE", "50"))
 
 
-async def process_file(file_obj, chat_history):
-    global conversation_log
-    conversation_log.clear()
-    chat_history = chat_history or []
+class ChatWindow:
+    """The last ``size`` chat messages of a session.
+
+    Only this window is sent to the browser on each update, so payloads stay
+    the same size however long the run gets; the full transcript is read
+    page by page from the job.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.messages: deque[dict[str, str]] = deque(maxlen=size)
+        self.total = 0
+
+    def add(self, role: str, content: str) -> None:
+        self.messages.append({"role": role, "content": content})
+        self.total += 1
+
+    def render(self) -> list[dict[str, str]]:
+        hidden = self.total - len(self.messages)
+        if not hidden:
+            return list(self.messages)
+        note = {"role": "system", "content": f"{hidden} earlier messages are in the full log below."}
+        return [note, *self.messages]
+
+
+async def process_file(file_obj):
+    chat = ChatWindow(VISIBLE_MESSAGES)
 
     if not file_obj or not hasattr(file_obj, "name"):
-        chat_history.append({"role": "system", "content": "Unable to read the uploaded file."})
-        yield chat_history, None
+        chat.add("system", "Unable to read the uploaded file.")
+        yield chat.render(), None, None
         return
 
     file_path = file_obj.name
     if not Path(file_path).exists():
-        chat_history.append({"role": "system", "content": f"File not found: {file_path}"})
-        yield chat_history, None
+        chat.add("system", f"File not found: {file_path}")
+        yield chat.render(), None, None
         return
 
-    chat_history.append(
-        {"role": "system", "content": "CSV file loaded. Starting chunk-level analysis..."}
-    )
-    yield chat_history, None
+    job, created = await job_queue.submit(file_path, chunk_size=1000)
+    if created:
+        chat.add("system", "CSV file loaded. Starting chunk-level analysis...")
+    else:
+        chat.add("system", f"This file was already submitted; following job {job.id}.")
+    yield chat.render(), None, job.id
 
-    async for update in run_analysis(file_path, chunk_size=1000):
-        chat_history.append({"role": "assistant", "content": update})
-        conversation_log.append({"source": "assistant", "content": update})
-        yield chat_history, None
+    async for position in job_queue.positions(job):
+        chat.add("system", f"Waiting for a free worker: position {position} in queue.")
+        yield chat.render(), None, job.id
 
-    df_log = pd.DataFrame(conversation_log)
-    log_file = "conversation_log.csv"
-    df_log.to_csv(log_file, index=False, encoding="utf-8-sig")
+    async for update in job_queue.follow(job):
+        chat.add("assistant", update)
+        yield chat.render(), None, job.id
+
+    if job.status == FAILED:
+        chat.add("system", f"Analysis failed: {job.error}")
+        yield chat.render(), None, job.id
+        return
+
+    chat.add("system", "Analysis complete.")
+    yield chat.render(), job.log_files, job.id
 
-    chat_history.append({"role": "system", "content": "Analysis complete."})
-    yield chat_history, log_file
+
+def show_log_page(job_id, page):
+    job = job_queue.get(job_id) if job_id else None
+    if job is None:
+        return "No analysis has been started in this session."
+    page = max(1, int(page or 1))
+    updates, page_count = job_queue.page(job, page - 1, LOG_PAGE_SIZE)
+    header = f"Page {page} of {page_count} ({len(job.updates)} messages, {job.status})"
+    return "\n\n".join([f"**{header}**", *updates])
 
 
 with gr.Blocks() as demo:
     gr.Markdown("### Agentic AI CSV Analysis Demo")
 
+    job_state = gr.State()
     file_input = gr.File(label="Upload CSV")
     chat_display = gr.Chatbot(label="Streaming Analysis", type="messages")
-    download_log = gr.File(label="Download Conversation Log")
+    download_log = gr.File(label="Download Conversation Log", file_count="multiple")
     start_btn = gr.Button("Start Analysis")
 
+    with gr.Accordion("Full log", open=False):
+        page_input = gr.Number(label="Page", value=1, precision=0, minimum=1)
+        page_btn = gr.Button("Show page")
+        log_page = gr.Markdown()
+
+    with gr.Accordion("Metrics", open=False):
+        metrics_btn = gr.Button("Refresh metrics")
+        metrics_view = gr.JSON()
+
     start_btn.click(
         fn=process_file,
-        inputs=[file_input, chat_display],
-        outputs=[chat_display, download_log],
+        inputs=[file_input],
+        outputs=[chat_display, download_log, job_state],
     )
+    page_btn.click(fn=show_log_page, inputs=[job_state, page_input], outputs=[log_page])
+    metrics_btn.click(fn=telemetry.summary, inputs=None, outputs=[metrics_view])
 
 
-demo.queue().launch()
+demo.queue(default_concurrency_limit=None).launch()
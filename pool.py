@@ -0,0 +1,81 @@
+"""Reusable chunk teams.
+
+Building a team per chunk also builds a new ``MultimodalWebSurfer``, and
+every web surfer launches its own Chromium instance on first use. The pool
+keeps one team per concurrency slot, hands teams out to chunk workers and
+resets them between chunks, so each browser is launched once per run.
+``TeamPool.warm`` launches the browsers up front, in parallel, so the first
+chunk on each slot does not pay for the launch either.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_ext.agents.web_surfer import MultimodalWebSurfer
+
+
+@dataclass
+class ChunkTeam:
+    team: RoundRobinGroupChat
+    web_surfer: MultimodalWebSurfer
+    termination: TerminationCondition | None = None
+
+    async def warm(self) -> None:
+        # MultimodalWebSurfer starts Playwright and opens its page on first
+        # use; trigger that now. Stub surfers have nothing to launch.
+        lazy_init = getattr(self.web_surfer, "_lazy_init", None)
+        if lazy_init is None or getattr(self.web_surfer, "did_lazy_init", True):
+            return
+        try:
+            await lazy_init()
+        except Exception as exc:
+            # Without a usable browser the surfer keeps its lazy launch, so a
+            # run whose agents never browse is not stopped here.
+            print(f"Could not pre-launch the web surfer browser: {exc}")
+
+    async def close(self) -> None:
+        await self.web_surfer.close()
+
+
+class TeamPool:
+    def __init__(self, factory: Callable[[], ChunkTeam], size: int) -> None:
+        self._factory = factory
+        self._members = [factory() for _ in range(max(1, size))]
+        self._idle: asyncio.Queue[ChunkTeam] = asyncio.Queue()
+        for member in self._members:
+            self._idle.put_nowait(member)
+
+    async def warm(self) -> None:
+        """Launch every member's browser now instead of on its first chunk."""
+        await asyncio.gather(*(member.warm() for member in self._members))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[RoundRobinGroupChat]:
+        """Borrow an idle team and give it back, reset, when the block exits."""
+        member = await self._idle.get()
+        if member.termination is not None:
+            # Start the chunk's wall-clock deadline now, not when the team
+            # was last reset and went idle.
+            await member.termination.reset()
+        try:
+            yield member.team
+        finally:
+            try:
+                await member.team.reset()
+            except Exception as exc:
+                # A team that cannot be reset (for example after its browser
+                # crashed) is replaced rather than handed to the next chunk.
+                print(f"Replacing chunk team after failed reset: {exc}")
+                await member.close()
+                self._members.remove(member)
+                member = self._factory()
+                self._members.append(member)
+            self._idle.put_nowait(member)
+
+    async def close(self) -> None:
+        for member in self._members:
+            await member.close()
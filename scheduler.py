@@ -0,0 +1,230 @@
+"""Rate-limited scheduling for concurrent chunk analysis.
+
+Every chunk team shares one model client, so starting all chunks at once
+quickly exceeds the provider quota. The scheduler caps how many chunks are
+in flight and draws from per-model request and token buckets before a
+chunk starts. When a slot frees up it picks the queued chunk that best fits
+the remaining token budget instead of strictly following file order.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+
+
+class TokenBucket:
+    """A bucket refilled continuously at ``rate_per_minute``.
+
+    The level may go negative when actual usage is reported after the
+    fact; callers then wait until the debt has been refilled.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float | None = None) -> None:
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self._level
+
+    def delay_for(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        missing = amount - self.available()
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate_per_second
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self._level -= amount
+
+
+class ModelRateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one model.
+
+    A limit of ``0`` disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+    def available_tokens(self) -> float:
+        return self.tokens.available() if self.tokens else float("inf")
+
+    def delay_for(self, tokens: int, requests: int = 1) -> float:
+        delays = [0.0]
+        if self.requests:
+            delays.append(self.requests.delay_for(requests))
+        if self.tokens:
+            delays.append(self.tokens.delay_for(tokens))
+        return max(delays)
+
+    def consume(self, tokens: int, requests: int = 1) -> None:
+        if self.requests:
+            self.requests.consume(requests)
+        if self.tokens:
+            self.tokens.consume(tokens)
+
+    async def acquire(self, tokens: int, requests: int = 1) -> None:
+        while (delay := self.delay_for(tokens, requests)) > 0:
+            await asyncio.sleep(delay)
+        self.consume(tokens, requests)
+
+
+_rate_limiters: dict[str, ModelRateLimiter] = {}
+
+
+def rate_limiter_for(model_name: str, requests_per_minute: int = 0, tokens_per_minute: int = 0) -> ModelRateLimiter:
+    """Return the shared limiter for ``model_name``, creating it on first use."""
+    if model_name not in _rate_limiters:
+        _rate_limiters[model_name] = ModelRateLimiter(requests_per_minute, tokens_per_minute)
+    return _rate_limiters[model_name]
+
+
+@dataclass
+class ScheduledJob:
+    index: int
+    estimated_tokens: int
+    factory: Callable[[], Awaitable[Any]]
+    context: Any = None
+    queued_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+
+    @property
+    def queue_wait(self) -> float:
+        """Seconds between the job being created and being started."""
+        return (self.started_at or self.queued_at) - self.queued_at
+
+
+class ChunkScheduler:
+    def __init__(
+        self,
+        limiter: ModelRateLimiter,
+        max_concurrency: int = 4,
+        stop_when: Callable[[], bool] | None = None,
+    ) -> None:
+        self.limiter = limiter
+        self.max_concurrency = max(1, max_concurrency)
+        # Once ``stop_when`` returns True no new jobs start; running jobs
+        # are allowed to finish.
+        self.stop_when = stop_when
+
+    def _pick(self, pending: list[ScheduledJob]) -> ScheduledJob | None:
+        # Prefer the largest chunk the token bucket can pay for right now so
+        # long chunks do not straggle at the end, and fall back to smaller
+        # chunks while the bucket refills.
+        if self.limiter.requests and self.limiter.requests.delay_for(1) > 0:
+            return None
+        budget = self.limiter.available_tokens()
+        capacity = self.limiter.tokens.capacity if self.limiter.tokens else float("inf")
+        fitting = [job for job in pending if min(job.estimated_tokens, capacity) <= budget]
+        if not fitting:
+            return None
+        return max(fitting, key=lambda job: (job.estimated_tokens, -job.index))
+
+    async def stream(
+        self,
+        jobs: AsyncIterable[ScheduledJob] | Iterable[ScheduledJob],
+        lookahead: int | None = None,
+    ) -> AsyncIterator[tuple[ScheduledJob, Any]]:
+        """Run ``jobs`` and yield ``(job, result)`` pairs as they complete.
+
+        Jobs are pulled from ``jobs`` only while fewer than ``lookahead``
+        are waiting for a slot, so a lazy source is never drained ahead of
+        the workers.
+        """
+        source = _as_async_iterator(jobs)
+        lookahead = lookahead or self.max_concurrency
+        pending: list[ScheduledJob] = []
+        running: dict[asyncio.Task, ScheduledJob] = {}
+        fetch: asyncio.Task | None = None
+        exhausted = False
+        stopped = False
+        try:
+            while True:
+                # Checked on every pass, not only while the source has rows,
+                # so jobs queued after the last fetch do not start either.
+                if not stopped and self.stop_when and self.stop_when():
+                    skipped = "" if exhausted else " and the rest of the input"
+                    print(f"Run budget spent; {len(pending)} queued jobs{skipped} are skipped.")
+                    stopped = exhausted = True
+                    pending.clear()
+                    if fetch is not None:
+                        fetch.cancel()
+                        fetch = None
+
+                if fetch is None and not exhausted and len(pending) < lookahead:
+                    fetch = asyncio.create_task(_next_job(source))
+
+                while pending and len(running) < self.max_concurrency:
+                    job = self._pick(pending)
+                    if job is None:
+                        break
+                    pending.remove(job)
+                    self.limiter.consume(job.estimated_tokens)
+                    job.started_at = time.monotonic()
+                    running[asyncio.create_task(job.factory())] = job
+
+                if exhausted and not pending and not running:
+                    return
+
+                timeout = None
+                if pending and len(running) < self.max_concurrency:
+                    smallest = min(job.estimated_tokens for job in pending)
+                    timeout = max(self.limiter.delay_for(smallest), 0.01)
+
+                waiters = set(running)
+                if fetch is not None:
+                    waiters.add(fetch)
+                if not waiters:
+                    await asyncio.sleep(timeout or 0.01)
+                    continue
+
+                done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is fetch:
+                        fetch = None
+                        job = task.result()
+                        if job is None:
+                            exhausted = True
+                        else:
+                            pending.append(job)
+                    else:
+                        yield running.pop(task), task.result()
+        finally:
+            if fetch is not None:
+                fetch.cancel()
+            for task in running:
+                task.cancel()
+            # Let cancelled jobs run their cleanup (such as returning a team
+            # to its pool) before the caller tears shared resources down.
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def run(self, jobs: AsyncIterable[ScheduledJob] | Iterable[ScheduledJob]) -> list[Any]:
+        """Run ``jobs`` and return their results in submission order."""
+        results: dict[int, Any] = {}
+        async for job, result in self.stream(jobs):
+            results[job.index] = result
+        return [results[index] for index in sorted(results)]
+
+
+async def _as_async_iterator(jobs: AsyncIterable[ScheduledJob] | Iterable[ScheduledJob]) -> AsyncIterator[ScheduledJob]:
+    if isinstance(jobs, AsyncIterable):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
+
+
+async def _next_job(source: AsyncIterator[ScheduledJob]) -> ScheduledJob | None:
+    return await anext(source, None)
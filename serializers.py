@@ -0,0 +1,87 @@
+"""Compact text encodings for CSV chunks embedded in prompts.
+
+Prompt size dominates both cost and latency of every agent turn, so the
+chunk is rendered with one of the serializers below instead of a Python
+repr of ``to_dict(orient="records")``, which repeats every column name on
+every row. Serializers are plain functions registered by name; add a new
+one with ``@register_serializer("name")``.
+"""
+
+from typing import Callable
+
+import pandas as pd
+
+Serializer = Callable[[pd.DataFrame], str]
+
+SERIALIZERS: dict[str, Serializer] = {}
+
+# Object columns with at most this many distinct values, each repeated on
+# average, are replaced by integer codes plus a legend.
+DICTIONARY_MAX_VALUES = 32
+
+
+def register_serializer(name: str) -> Callable[[Serializer], Serializer]:
+    def decorator(func: Serializer) -> Serializer:
+        SERIALIZERS[name] = func
+        return func
+
+    return decorator
+
+
+def get_serializer(name: str) -> Serializer:
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown chunk serializer '{name}'. Choose one of: {', '.join(SERIALIZERS)}") from None
+
+
+@register_serializer("records")
+def serialize_records(chunk: pd.DataFrame) -> str:
+    """The original encoding: a list of dicts, one per row."""
+    # Keep timestamps as plain text rather than ``Timestamp(...)`` reprs.
+    timestamps = chunk.select_dtypes("datetime").columns
+    if len(timestamps):
+        chunk = chunk.astype({col: "string" for col in timestamps})
+    return str(chunk.to_dict(orient="records"))
+
+
+@register_serializer("csv")
+def serialize_csv(chunk: pd.DataFrame) -> str:
+    return "Format: CSV with a header row.\n" + chunk.to_csv(index=False).strip()
+
+
+@register_serializer("tsv")
+def serialize_tsv(chunk: pd.DataFrame) -> str:
+    return "Format: TSV with a header row.\n" + chunk.to_csv(index=False, sep="\t").strip()
+
+
+@register_serializer("columnar")
+def serialize_columnar(chunk: pd.DataFrame) -> str:
+    """Drop empty and constant columns and dictionary-encode repeated values."""
+    lines = ["Format: constant columns, value dictionaries, then CSV rows using dictionary codes."]
+    data = chunk.dropna(axis="columns", how="all")
+    dropped = [col for col in chunk.columns if col not in data.columns]
+    if dropped:
+        lines.append(f"Empty columns: {', '.join(map(str, dropped))}")
+
+    if len(data) > 1:
+        constant = [col for col in data.columns if data[col].nunique(dropna=False) == 1]
+        if constant:
+            lines.append("Constant columns: " + "; ".join(f"{col}={data[col].iloc[0]}" for col in constant))
+            data = data.drop(columns=constant)
+
+    encoded = {}
+    for col in data.columns:
+        if not pd.api.types.is_string_dtype(data[col]):
+            continue
+        values = data[col].dropna().unique()
+        if not 0 < len(values) <= DICTIONARY_MAX_VALUES or len(values) * 2 > data[col].count():
+            continue
+        codes = {value: code for code, value in enumerate(values)}
+        lines.append(f"Dictionary {col}: " + " | ".join(f"{code}={value}" for value, code in codes.items()))
+        encoded[col] = data[col].map(codes).astype("Int64")
+    if encoded:
+        data = data.assign(**encoded)
+
+    lines.append(data.to_csv(index=False).strip())
+    return "\n".join(lines)
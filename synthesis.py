@@ -0,0 +1,168 @@
+"""Hierarchical map-reduce synthesis of chunk conclusions.
+
+Chunk conclusions are merged in a tree with a fixed fan-in: as soon as
+``fan_in`` sibling chunks (or sibling summaries one level up) are done,
+one model call merges them, while other chunks are still running. A run
+with ``n`` chunks needs about ``log(n) / log(fan_in)`` reduce rounds after
+the last chunk finishes, and no prompt holds more than ``fan_in``
+summaries.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from autogen_core.models import ChatCompletionClient, UserMessage
+
+from scheduler import ModelRateLimiter
+from telemetry import telemetry
+from tokens import estimate_tokens
+
+# Conclusions longer than this are cut before they enter a reduce prompt.
+MAX_CONCLUSION_CHARS = 4000
+
+
+@dataclass
+class Summary:
+    batch_start: int
+    batch_end: int
+    text: str
+
+
+def chunk_conclusion(messages: list[dict[str, Any]]) -> Summary | None:
+    """Use the last agent message of a chunk conversation as its conclusion."""
+    replies = [msg for msg in messages if msg["source"] != "user_proxy" and msg["content"]]
+    if not replies:
+        return None
+    last = replies[-1]
+    return Summary(last["batch_start"], last["batch_end"], str(last["content"])[:MAX_CONCLUSION_CHARS])
+
+
+def model_reducer(
+    model_client: ChatCompletionClient,
+    rate_limiter: ModelRateLimiter | None = None,
+) -> Callable[[list[Summary]], Awaitable[str]]:
+    """Return a reduce function that merges summaries with one model call."""
+
+    async def reduce(children: list[Summary]) -> str:
+        sections = "\n\n".join(
+            f"Records {child.batch_start}-{child.batch_end}:\n{child.text}" for child in children
+        )
+        prompt = (
+            "Below are analyses of consecutive record ranges from the same dataset.\n\n"
+            f"{sections}\n\n"
+            "Merge them into one concise synthesis: keep the patterns and insights that "
+            "hold across ranges, note important differences between ranges, and end with "
+            "a short recommendation for a human operator."
+        )
+        estimated_tokens = estimate_tokens(prompt)
+        if rate_limiter:
+            await rate_limiter.acquire(estimated_tokens)
+        started = time.monotonic()
+        result = await model_client.create([UserMessage(content=prompt, source="user")])
+        model = model_client.model_info.get("family", "unknown")
+        telemetry.observe("agent_turn_seconds", time.monotonic() - started, agent="synthesis")
+        telemetry.count("agent_messages_total", agent="synthesis")
+        telemetry.count("agent_prompt_tokens_total", result.usage.prompt_tokens, agent="synthesis", model=model)
+        telemetry.count("agent_completion_tokens_total", result.usage.completion_tokens, agent="synthesis", model=model)
+        if rate_limiter:
+            used_tokens = result.usage.prompt_tokens + result.usage.completion_tokens
+            rate_limiter.consume(used_tokens - estimated_tokens, requests=0)
+        return str(result.content)
+
+    return reduce
+
+
+class TreeReducer:
+    """Reduce leaf summaries bottom-up as soon as each sibling group is complete.
+
+    Leaves are added with their position in the input; ``finish`` tells the
+    reducer how many leaves there are so the trailing partial groups can be
+    reduced too.
+    """
+
+    def __init__(self, reduce: Callable[[list[Summary]], Awaitable[str]], fan_in: int = 4) -> None:
+        self._reduce = reduce
+        self.fan_in = max(2, fan_in)
+        self._levels: list[dict[int, Summary | None]] = [{}]
+        self._sizes: list[int | None] = [None]
+        self._tasks: set[asyncio.Task] = set()
+        self._root: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def add(self, index: int, summary: Summary | None) -> None:
+        """Add the conclusion of leaf ``index``; ``None`` marks a chunk without one."""
+        self._add(0, index, summary)
+
+    def finish(self, leaf_count: int) -> None:
+        if leaf_count == 0:
+            self._resolve(None)
+            return
+        level, size = 0, leaf_count
+        while True:
+            self._ensure_level(level)
+            self._sizes[level] = size
+            if size == 1 and level > 0:
+                if 0 in self._levels[level]:
+                    self._resolve(self._levels[level].pop(0))
+                return
+            # Full groups were reduced as they completed; only the trailing
+            # partial group was waiting for the level size to be known.
+            self._check_group(level, (size - 1) // self.fan_in)
+            size = -(-size // self.fan_in)
+            level += 1
+
+    async def result(self) -> Summary | None:
+        """Wait for the root of the tree: the final synthesis."""
+        try:
+            return await self._root
+        finally:
+            self.cancel()
+
+    def cancel(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _ensure_level(self, level: int) -> None:
+        while len(self._levels) <= level:
+            self._levels.append({})
+            self._sizes.append(None)
+
+    def _add(self, level: int, index: int, summary: Summary | None) -> None:
+        self._ensure_level(level)
+        if level > 0 and self._sizes[level] == 1:
+            self._resolve(summary)
+            return
+        self._levels[level][index] = summary
+        self._check_group(level, index // self.fan_in)
+
+    def _resolve(self, summary: Summary | None) -> None:
+        if not self._root.done():
+            self._root.set_result(summary)
+
+    def _check_group(self, level: int, group: int) -> None:
+        nodes = self._levels[level]
+        size = self._sizes[level]
+        first = group * self.fan_in
+        last = first + self.fan_in if size is None else min(first + self.fan_in, size)
+        if any(index not in nodes for index in range(first, last)):
+            return
+        children = [nodes.pop(index) for index in range(first, last)]
+        task = asyncio.create_task(self._merge(level, group, [child for child in children if child is not None]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _merge(self, level: int, group: int, children: list[Summary]) -> None:
+        try:
+            if not children:
+                merged = None
+            elif len(children) == 1 and level > 0:
+                merged = children[0]
+            else:
+                text = await self._reduce(children)
+                merged = Summary(children[0].batch_start, children[-1].batch_end, text)
+        except Exception as exc:
+            if not self._root.done():
+                self._root.set_exception(exc)
+            return
+        self._add(level + 1, group, merged)
@@ -0,0 +1,136 @@
+"""Token, latency and throughput metrics for agent runs.
+
+Chunk conversations report tokens per message but nothing adds them up or
+says where the time goes. ``telemetry`` collects labelled counters and
+latency histograms for the whole process (agents, chunks, models and the
+scheduler queue) and exports them as a JSON summary or in the Prometheus
+text format, so the agent that dominates wall time and spend stands out.
+"""
+
+import json
+import os
+from bisect import bisect_left
+
+# Upper bounds in seconds; chunk conversations with web browsing take minutes.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (the max for the last bucket)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 3),
+        }
+
+
+def _labels(labels: dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_text(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _prometheus_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Telemetry:
+    def __init__(self) -> None:
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+
+    def count(self, name: str, value: float = 1, **labels: object) -> None:
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: object) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(seconds)
+
+    def summary(self) -> dict[str, dict[str, dict]]:
+        return {
+            "counters": {
+                name: {_label_text(labels): value for labels, value in series.items()}
+                for name, series in self.counters.items()
+            },
+            "histograms": {
+                name: {_label_text(labels): histogram.summary() for labels, histogram in series.items()}
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_prometheus_labels(labels)} {value}")
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_prometheus_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_prometheus_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_prometheus_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: str | None = None, prometheus_path: str | None = None) -> None:
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as handle:
+                json.dump(self.summary(), handle, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, "w", encoding="utf-8") as handle:
+                handle.write(self.to_prometheus())
+
+
+# One collector per process, shared by every run and UI job in it.
+telemetry = Telemetry()
+
+
+def write_telemetry_from_env() -> None:
+    """Export ``telemetry`` to ``TELEMETRY_JSON`` and ``TELEMETRY_PROM`` when they are set."""
+    telemetry.write(os.getenv("TELEMETRY_JSON") or None, os.getenv("TELEMETRY_PROM") or None)
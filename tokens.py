@@ -0,0 +1,30 @@
+"""Fast local token estimation.
+
+Exact tokenizers differ per model and are slow to load, so the pipeline
+uses a cheap character-based estimate when it only needs to budget
+requests. ASCII text averages roughly four characters per token, while
+CJK characters are usually one token each.
+"""
+
+import pandas as pd
+
+ASCII_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return -(-ascii_chars // ASCII_CHARS_PER_TOKEN) + other_chars
+
+
+def estimate_row_tokens(df: pd.DataFrame) -> pd.Series:
+    """Vectorized per-row estimate of the tokens needed to write ``df`` as CSV."""
+    total = pd.Series(0, index=df.index, dtype="int64")
+    for col in df.columns:
+        values = df[col].astype("string").fillna("")
+        chars = values.str.len().astype("int64")
+        other_chars = values.str.count(r"[^\x00-\x7f]").astype("int64")
+        total += -(-(chars - other_chars) // ASCII_CHARS_PER_TOKEN) + other_chars + 1
+    return total
@@ -0,0 +1,174 @@
+"""Shared cache for web-surfer searches and page visits.
+
+Concurrent chunk teams are all asked to add recent external context, so
+their web surfers issue nearly the same searches and page visits. The
+cache sits in front of the ``web_search`` and ``visit_url`` actions of
+``MultimodalWebSurfer``: results are keyed by the normalized query or URL,
+expire after a TTL, are bounded by LRU eviction, and identical requests
+in flight at the same time are fetched once. A cache can be saved to and
+loaded from a JSON file so later runs start warm.
+
+A cache hit returns the text observation of the earlier visit without
+moving the hit surfer's browser, so it answers the question but follow-up
+clicks act on whatever page that browser last showed.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from autogen_core import CancellationToken, FunctionCall
+from autogen_core.models import ChatCompletionClient
+from autogen_ext.agents.web_surfer import MultimodalWebSurfer
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+    if not url.startswith(("https://", "http://", "file://", "about:")):
+        url = "https://" + url
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+def cache_key(tool_name: str, args: dict[str, Any]) -> str | None:
+    """Return the cache key for a web-surfer action, or None if it is not cacheable."""
+    if tool_name == "web_search":
+        return "search:" + normalize_query(args.get("query", ""))
+    if tool_name == "visit_url":
+        url = args.get("url", "")
+        # The surfer treats an address with spaces as a search query.
+        if " " in url and not url.startswith(("https://", "http://")):
+            return "search:" + normalize_query(url)
+        return "url:" + normalize_url(url)
+    return None
+
+
+class WebCache:
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 512, path: str | None = None) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached value for ``key`` or fetch it once for all waiters."""
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        if key in self._in_flight:
+            self.hits += 1
+            return await asyncio.shield(self._in_flight[key])
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # The owner re-raises below, so mark the exception as retrieved
+            # even when no other request is waiting on it.
+            future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def load(self) -> None:
+        with open(self.path, encoding="utf-8") as handle:
+            saved = json.load(handle)
+        now = time.time()
+        for key, stored_at, value in saved:
+            if now - stored_at <= self.ttl_seconds:
+                self._entries[key] = (stored_at, value)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        payload = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def web_cache_from_env() -> WebCache:
+    """Build the run's cache from ``WEB_CACHE_TTL``, ``WEB_CACHE_SIZE`` and ``WEB_CACHE_PATH``."""
+    return WebCache(
+        ttl_seconds=float(os.getenv("WEB_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("WEB_CACHE_SIZE", "512")),
+        path=os.getenv("WEB_CACHE_PATH") or None,
+    )
+
+
+class CachedWebSurfer(MultimodalWebSurfer):
+    """A ``MultimodalWebSurfer`` whose searches and page visits go through a ``WebCache``."""
+
+    def __init__(self, name: str, model_client: ChatCompletionClient, web_cache: WebCache, **kwargs: Any) -> None:
+        super().__init__(name, model_client, **kwargs)
+        self._web_cache = web_cache
+
+    async def _execute_tool(
+        self,
+        message: list[FunctionCall],
+        rects: dict[str, Any],
+        tool_names: str,
+        cancellation_token: CancellationToken | None = None,
+    ) -> Any:
+        key = cache_key(message[0].name, json.loads(message[0].arguments))
+        if key is None:
+            return await super()._execute_tool(message, rects, tool_names, cancellation_token=cancellation_token)
+
+        live_content = None
+
+        async def fetch() -> str:
+            nonlocal live_content
+            live_content = await super(CachedWebSurfer, self)._execute_tool(
+                message, rects, tool_names, cancellation_token=cancellation_token
+            )
+            # Only the text observation is cached; screenshots are not reused.
+            if isinstance(live_content, str):
+                return live_content
+            return "\n".join(part for part in live_content if isinstance(part, str))
+
+        cached_text = await self._web_cache.get_or_fetch(key, fetch)
+        return live_content if live_content is not None else cached_text